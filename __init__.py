@@ -0,0 +1,19 @@
+import os
+import sys
+
+# modules of the package import each other as top level modules
+_package_dir = os.path.dirname(os.path.abspath(__file__))
+if _package_dir not in sys.path:
+    sys.path.insert(0, _package_dir)
+
+from algorithms import ALGORITHMS, get_algorithm, register_algorithm, resolve # noqa: E402
+
+
+def __getattr__(name: str):
+    if name in ALGORITHMS:
+        return get_algorithm(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(ALGORITHMS))
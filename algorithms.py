@@ -0,0 +1,53 @@
+import typing as tp
+import importlib
+
+
+# name -> 'module:attribute', modules are imported only when the algorithm is requested
+ALGORITHMS: tp.Dict[str, str] = {
+    'des': 'lab1_des:Des',
+    'double_des': 'lab1_double_des:DoubleDes',
+    'triple_des': 'lab1_triple_des:TripleDes',
+    'gost': 'lab1_gost:Gost2814789',
+    'stb': 'lab2:Stb',
+    'rsa': 'lab3:RSA',
+    'elgamal': 'lab4:ElGamal',
+    'md5': 'lab5:MD5',
+    'dsa': 'lab6:DigitalSignature',
+    'ecdsa': 'lab7:DigitalSignature',
+    'ec_encoder': 'lab7:Encoder',
+    'stego_embed': 'lab8:embed',
+    'stego_extract': 'lab8:extract',
+}
+
+_resolved: tp.Dict[str, tp.Any] = {}
+
+
+def resolve(path: str) -> tp.Any:
+    """
+    :param path: 'module:attribute' or just 'module'
+    :return: imported attribute or module
+    """
+    if path not in _resolved:
+        module_name, _, attribute = path.partition(':')
+        module = importlib.import_module(module_name)
+        _resolved[path] = getattr(module, attribute) if attribute else module
+    return _resolved[path]
+
+
+def get_algorithm(name: str) -> tp.Any:
+    """
+    :param name: key of ALGORITHMS
+    :return: class or function implementing the algorithm
+    """
+    if name not in ALGORITHMS:
+        raise KeyError(f'Unknown algorithm {name}, available: {", ".join(ALGORITHMS)}')
+    return resolve(ALGORITHMS[name])
+
+
+def register_algorithm(name: str, path: str) -> None:
+    """
+    :param name: name to use in get_algorithm
+    :param path: 'module:attribute' of the implementation, it isn't imported until requested
+    """
+    ALGORITHMS[name] = path
+    _resolved.pop(path, None)
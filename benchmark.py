@@ -0,0 +1,491 @@
+import typing as tp
+import argparse
+import dataclasses
+import json
+import os
+import platform
+import random
+import resource
+import string
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bitarray import bitarray
+
+from algorithms import ALGORITHMS, get_algorithm, resolve
+from functions import are_relatively_prime, is_prime, mod_inverse
+
+
+# symmetric ciphers, hashes, EC encryption and steganography take payload sizes in bytes,
+# other public key algorithms take key sizes in bits
+DEFAULT_DATA_SIZES = ('1K', '4K')
+DEFAULT_KEY_SIZES = (24, 32)
+DEFAULT_CURVE_SIZES = (256,)
+# messages encrypted and signed by public key algorithms
+PUBLIC_KEY_MESSAGE_LENGTH = 1024
+SIGNATURES_AMOUNT = 16
+SEED = 2836
+# seconds a fresh interpreter may spend importing a module
+DEFAULT_IMPORT_BUDGET = 0.1
+IMPORT_BUDGETS = {
+    # numpy and PIL are used by lab8 itself
+    'lab8': 0.3,
+}
+
+
+@dataclasses.dataclass
+class Workload:
+    """
+    Prepared benchmark: run is timed, everything else is done before timing starts
+    """
+    run: tp.Callable[[], tp.Any]
+    bytes_processed: int = 0
+    blocks: int = 0
+    operations: int = 0
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    name: str
+    size: int
+    seconds: float
+    bytes_processed: int
+    blocks: int
+    operations: int
+    peak_rss_kb: int
+
+    @property
+    def key(self) -> str:
+        return f'{self.name}@{self.size}'
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes_processed / self.seconds / 2 ** 20 if self.seconds else 0.
+
+    @property
+    def blocks_per_second(self) -> float:
+        return self.blocks / self.seconds if self.seconds else 0.
+
+    @property
+    def operations_per_second(self) -> float:
+        return self.operations / self.seconds if self.seconds else 0.
+
+
+@dataclasses.dataclass
+class Comparison:
+    key: str
+    seconds: float
+    baseline_seconds: float
+    peak_rss_kb: int
+    baseline_peak_rss_kb: int
+    tolerance: float
+
+    @property
+    def ratio(self) -> float:
+        return self.seconds / self.baseline_seconds if self.baseline_seconds else 1.
+
+    @property
+    def is_time_regression(self) -> bool:
+        return self.ratio > 1 + self.tolerance
+
+    @property
+    def is_memory_regression(self) -> bool:
+        return self.peak_rss_kb > self.baseline_peak_rss_kb * (1 + self.tolerance)
+
+
+def parse_size(size: str) -> int:
+    """
+    :param size: amount of bytes with optional K, M or G suffix, for example 16K
+    :return: amount of bytes
+    """
+    multipliers = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+    size = size.strip().upper()
+    if size and size[-1] in multipliers:
+        return int(size[:-1]) * multipliers[size[-1]]
+    return int(size)
+
+
+def _random_bytes(size: int, seed: int = SEED) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def _random_text(size: int) -> str:
+    rng = random.Random(SEED)
+    return ''.join(rng.choices(string.ascii_letters + string.digits + ' ', k=size))
+
+
+def _random_bits(size: int, seed: int = SEED) -> bitarray:
+    result = bitarray()
+    result.frombytes(_random_bytes((size + 7) // 8, seed))
+    return result[:size]
+
+
+def _random_prime(bits: int, rng: random.Random) -> int:
+    while True:
+        candidate = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if is_prime(candidate):
+            return candidate
+
+
+def _random_ec_key_pair(base: tp.Any, rng: random.Random) -> tp.Tuple[int, tp.Any]:
+    """
+    Same as generate_key_pair of lab7 classes, but the private key is taken from the seeded generator
+    """
+    private_key = rng.randrange(1, base.curve.field.n)
+    return private_key, base.multiply_generator(private_key)
+
+
+def _get_curve(bits: int):
+    return resolve('tinyec.registry:get_curve')(f'secp{bits}r1')
+
+
+def _make_block_cipher(name: str):
+    if name in ('gost', 'stb'):
+        return get_algorithm(name)(_random_bits(256))
+    parameters = get_algorithm('des').generate_parameters()
+    if name == 'des':
+        return get_algorithm(name)(parameters, _random_bits(56))
+    return get_algorithm(name)(parameters, _random_bits(56), _random_bits(56, SEED + 1))
+
+
+def _block_cipher_workload(name: str, operation: str, size: int) -> Workload:
+    cipher = _make_block_cipher(name)
+    message = bitarray()
+    message.frombytes(_random_bytes(size))
+    blocks = -(-len(message) // cipher._message_block_length) # noqa
+    if operation == 'encrypt':
+        return Workload(lambda: cipher.encrypt(message), size, blocks)
+    encrypted_message = cipher.encrypt(message)
+    return Workload(lambda: cipher.decrypt(encrypted_message), size, blocks)
+
+
+def _md5_workload(operation: str, size: int) -> Workload:
+    md5 = get_algorithm('md5')()
+    message = bitarray()
+    message.frombytes(_random_bytes(size))
+    return Workload(lambda: md5.hash_message(message), size, (size * 8 + 64) // 512 + 1)
+
+
+def _rsa_workload(operation: str, bits: int) -> Workload:
+    RSA = get_algorithm('rsa')
+    rng = random.Random(SEED)
+    p, q = _random_prime(bits // 2, rng), _random_prime(bits - bits // 2, rng)
+    # same as RSA.generate_key_pair, but d is taken from the seeded generator
+    n, phi = p * q, (p - 1) * (q - 1)
+    d = rng.randrange(1, n)
+    while not are_relatively_prime(d, phi):
+        d = rng.randrange(1, n)
+    encoder = RSA((d, n), (mod_inverse(d, phi), n))
+    message = _random_text(PUBLIC_KEY_MESSAGE_LENGTH)
+    chunks = len(RSA.encode_message(message))
+    if operation == 'encrypt':
+        return Workload(lambda: encoder.encrypt(message), PUBLIC_KEY_MESSAGE_LENGTH, chunks, chunks)
+    encrypted_message = encoder.encrypt(message)
+    return Workload(lambda: encoder.decrypt(encrypted_message), PUBLIC_KEY_MESSAGE_LENGTH, chunks, chunks)
+
+
+def _elgamal_workload(operation: str, bits: int) -> Workload:
+    ElGamal = get_algorithm('elgamal')
+    encoder = ElGamal(_random_prime(bits, random.Random(SEED)))
+    message = _random_text(PUBLIC_KEY_MESSAGE_LENGTH)
+    chunks = len(ElGamal.encode_message(message))
+    if operation == 'encrypt':
+        return Workload(lambda: encoder.encrypt(message), PUBLIC_KEY_MESSAGE_LENGTH, chunks, chunks)
+    first, second = encoder.encrypt(message)
+    return Workload(lambda: encoder.decrypt(first, second), PUBLIC_KEY_MESSAGE_LENGTH, chunks, chunks)
+
+
+def _dsa_workload(operation: str, bits: int) -> Workload:
+    rng = random.Random(SEED)
+    q = _random_prime(bits // 2, rng)
+    while True:
+        p = 2 * rng.getrandbits(bits - bits // 2 - 1) * q + 1
+        if p.bit_length() == bits and is_prime(p):
+            break
+    ds = get_algorithm('dsa')(p, q)
+    messages = [_random_text(64) + str(i) for i in range(SIGNATURES_AMOUNT)]
+    if operation == 'sign':
+        return Workload(lambda: [ds.sign(message, ds.private_key) for message in messages],
+                        operations=SIGNATURES_AMOUNT)
+    signatures = [ds.sign(message, ds.private_key) for message in messages]
+    return Workload(lambda: [ds.verify(message, signature.r, signature.s, ds.public_key)
+                             for message, signature in zip(messages, signatures)], operations=SIGNATURES_AMOUNT)
+
+
+def _ecdsa_workload(operation: str, bits: int) -> Workload:
+    ds = get_algorithm('ecdsa')(_get_curve(bits))
+    private_key, public_key = _random_ec_key_pair(ds, random.Random(SEED))
+    messages = [_random_text(64) + str(i) for i in range(SIGNATURES_AMOUNT)]
+    if operation == 'sign':
+        return Workload(lambda: [ds.sign(message, private_key) for message in messages],
+                        operations=SIGNATURES_AMOUNT)
+    signatures = [ds.sign(message, private_key) for message in messages]
+    return Workload(lambda: [ds.verify_signature(message, signature.r, signature.s, public_key)
+                             for message, signature in zip(messages, signatures)], operations=SIGNATURES_AMOUNT)
+
+
+def _ec_encoder_workload(operation: str, size: int) -> Workload:
+    rng = random.Random(SEED)
+    curve = _get_curve(DEFAULT_CURVE_SIZES[0])
+    encoder = get_algorithm('ec_encoder')(curve, multiplier=rng.randrange(1, curve.field.n))
+    private_key, public_key = _random_ec_key_pair(encoder, rng)
+    message = _random_text(size)
+    # table embedding turns every byte into a point
+    if operation == 'encode':
+        return Workload(lambda: encoder.encode(message, public_key), size, size, size)
+    encoded_message, ephemeral_public_key = encoder.encode(message, public_key)
+    return Workload(lambda: encoder.decode(encoded_message, private_key, ephemeral_public_key), size, size, size)
+
+
+def _stego_workload(operation: str, size: int) -> Workload:
+    import numpy as np
+    from PIL import Image
+    import lab8
+    side = int(np.ceil(np.sqrt((size * 8 + lab8.HEADER_LENGTH * 8) / 3))) + 1
+    image = Image.fromarray(np.random.RandomState(SEED).randint(0, 256, (side, side, 3), dtype=np.uint8))
+    payload = _random_bytes(size)
+    if operation == 'embed':
+        return Workload(lambda: lab8.embed(image, payload), size)
+    image_with_payload = lab8.embed(image, payload)
+    return Workload(lambda: lab8.extract(image_with_payload), size)
+
+
+# name -> (kind of size, workload factory)
+CASES: tp.Dict[str, tp.Tuple[str, tp.Callable[[int], Workload]]] = {}
+for _cipher in ('des', 'double_des', 'triple_des', 'gost', 'stb'):
+    for _operation in ('encrypt', 'decrypt'):
+        CASES[f'{_cipher}/{_operation}'] = ('data', lambda size, c=_cipher, o=_operation:
+                                            _block_cipher_workload(c, o, size))
+for _prefix, _kind, _factory, _operations in (('md5', 'data', _md5_workload, ('hash',)),
+                                              ('rsa', 'key', _rsa_workload, ('encrypt', 'decrypt')),
+                                              ('elgamal', 'key', _elgamal_workload, ('encrypt', 'decrypt')),
+                                              ('dsa', 'key', _dsa_workload, ('sign', 'verify')),
+                                              ('ecdsa', 'curve', _ecdsa_workload, ('sign', 'verify')),
+                                              ('ec_encoder', 'data', _ec_encoder_workload, ('encode', 'decode')),
+                                              ('stego', 'data', _stego_workload, ('embed', 'extract'))):
+    for _operation in _operations:
+        CASES[f'{_prefix}/{_operation}'] = (_kind, lambda size, f=_factory, o=_operation: f(o, size))
+
+
+def _get_peak_rss_kb() -> int:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+
+def run_case(name: str, size: int, repeats: int = 3) -> BenchmarkResult:
+    """
+    Runs single benchmark in the current process. Random generators are seeded, so every run processes
+    the same data, RSA, ECDSA and EC encoder cases also use the same keys. ElGamal and DSA draw their keys
+    and EC encoder its session keys from secrets inside the algorithms, these values differ between runs,
+    only their sizes are fixed, so these cases are comparable but not exactly reproducible
+    :param name: key of CASES
+    :param size: payload size in bytes or key size in bits, depending on the case
+    :param repeats: amount of timed runs, the fastest one is reported
+    :return: benchmark result, peak RSS is the peak of the whole process
+    """
+    random.seed(SEED)
+    workload = CASES[name][1](size)
+    best_time = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        workload.run()
+        best_time = min(best_time, time.perf_counter() - start)
+    return BenchmarkResult(name, size, best_time, workload.bytes_processed, workload.blocks,
+                           workload.operations, _get_peak_rss_kb())
+
+
+def run_isolated_case(name: str, size: int, repeats: int = 3) -> BenchmarkResult:
+    """
+    Same as run_case, but in a fresh process, so peak RSS and caches belong to this case only
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_case, name, size, repeats).result()
+
+
+def run_engine_benchmarks(curve_sizes: tp.Iterable[int] = DEFAULT_CURVE_SIZES,
+                          iterations: int = 20) -> tp.List[BenchmarkResult]:
+    """
+    Wraps lab7.benchmark_engines, every engine gets generator and variable base results
+    """
+    from lab7 import benchmark_engines
+    results = []
+    for bits in curve_sizes:
+        for engine, times in benchmark_engines(_get_curve(bits), iterations).items():
+            for kind, seconds in times.items():
+                results.append(BenchmarkResult(f'ec_engine/{engine}/{kind}', bits, seconds * iterations, 0, 0,
+                                               iterations, _get_peak_rss_kb()))
+    return results
+
+
+def run_benchmarks(names: tp.Optional[tp.Iterable[str]] = None,
+                   data_sizes: tp.Iterable[int] = tuple(map(parse_size, DEFAULT_DATA_SIZES)),
+                   key_sizes: tp.Iterable[int] = DEFAULT_KEY_SIZES,
+                   curve_sizes: tp.Iterable[int] = DEFAULT_CURVE_SIZES,
+                   repeats: int = 3, isolated: bool = True,
+                   callback: tp.Optional[tp.Callable[[BenchmarkResult], None]] = None) -> tp.List[BenchmarkResult]:
+    """
+    :param names: keys of CASES to run, all of them by default
+    :param data_sizes: payload sizes in bytes for data cases
+    :param key_sizes: modulus sizes in bits for RSA, ElGamal and DSA
+    :param curve_sizes: sizes of secpXXXr1 curves for ECDSA and engine comparison
+    :param repeats: amount of timed runs of every case
+    :param isolated: whether every case should run in its own process
+    :param callback: called with every result as soon as it is ready
+    :return: results of all cases
+    """
+    sizes = {'data': tuple(data_sizes), 'key': tuple(key_sizes), 'curve': tuple(curve_sizes)}
+    runner = run_isolated_case if isolated else run_case
+    results = []
+    for name in CASES if names is None else names:
+        for size in sizes[CASES[name][0]]:
+            results.append(runner(name, size, repeats))
+            if callback is not None:
+                callback(results[-1])
+    return results
+
+
+def measure_import_time(module: str, repeats: int = 3) -> float:
+    """
+    :param module: name of the module of this directory
+    :param repeats: amount of fresh interpreters to import the module in, the fastest import is reported
+    :return: seconds spent on the import, interpreter startup excluded
+    """
+    code = f'import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+    return min(float(subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    check=True, capture_output=True, text=True).stdout)
+               for _ in range(repeats))
+
+
+def check_import_budgets(modules: tp.Optional[tp.Iterable[str]] = None) -> tp.Dict[str, tp.Tuple[float, float]]:
+    """
+    :param modules: modules to check, all modules of the algorithm registry and cli by default
+    :return: import time and budget in seconds for every module
+    """
+    if modules is None:
+        modules = sorted({path.partition(':')[0] for path in ALGORITHMS.values()} | {'algorithms', 'cli'})
+    return {module: (measure_import_time(module), IMPORT_BUDGETS.get(module, DEFAULT_IMPORT_BUDGET))
+            for module in modules}
+
+
+def save_baseline(results: tp.Iterable[BenchmarkResult], path: str,
+                  import_times: tp.Optional[tp.Dict[str, tp.Tuple[float, float]]] = None) -> None:
+    baseline = {
+        'meta': {'python': platform.python_version(), 'machine': platform.machine(), 'platform': platform.platform(),
+                 'created': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': {result.key: dataclasses.asdict(result) for result in results},
+        'imports': {module: seconds for module, (seconds, _) in (import_times or {}).items()},
+    }
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+
+
+def load_baseline(path: str) -> tp.Dict[str, BenchmarkResult]:
+    with open(path, 'r') as f:
+        baseline = json.load(f)
+    return {key: BenchmarkResult(**value) for key, value in baseline['results'].items()}
+
+
+def load_baseline_import_times(path: str) -> tp.Dict[str, float]:
+    """
+    :return: import time in seconds for every module of the baseline, empty if imports were not measured
+    """
+    with open(path, 'r') as f:
+        baseline = json.load(f)
+    return baseline.get('imports', {})
+
+
+def compare(results: tp.Iterable[BenchmarkResult], baseline: tp.Dict[str, BenchmarkResult],
+            tolerance: float = 0.1) -> tp.List[Comparison]:
+    """
+    :param results: current results
+    :param baseline: results loaded with load_baseline
+    :param tolerance: relative slowdown (or peak RSS growth) which is not considered a regression
+    :return: comparisons for results present in the baseline
+    """
+    return [Comparison(result.key, result.seconds, baseline[result.key].seconds, result.peak_rss_kb,
+                       baseline[result.key].peak_rss_kb, tolerance)
+            for result in results if result.key in baseline]
+
+
+def compare_import_times(import_times: tp.Dict[str, tp.Tuple[float, float]], baseline: tp.Dict[str, float],
+                         tolerance: float = 0.1) -> tp.List[Comparison]:
+    """
+    :param import_times: result of check_import_budgets
+    :param baseline: import times loaded with load_baseline_import_times
+    :param tolerance: relative slowdown which is not considered a regression
+    :return: comparisons for modules present in the baseline, memory is not measured for imports
+    """
+    return [Comparison(f'import/{module}', seconds, baseline[module], 0, 0, tolerance)
+            for module, (seconds, _) in import_times.items() if module in baseline]
+
+
+def format_result(result: BenchmarkResult) -> str:
+    return (f'{result.key:<32} {result.seconds * 1000:>11.2f} ms {result.mb_per_second:>9.4f} MB/s '
+            f'{result.blocks_per_second:>11.1f} blocks/s {result.operations_per_second:>11.1f} ops/s '
+            f'{result.peak_rss_kb / 1024:>8.1f} MB RSS')
+
+
+def format_comparison(comparison: Comparison) -> str:
+    flags = [flag for flag, is_set in (('TIME', comparison.is_time_regression),
+                                       ('RSS', comparison.is_memory_regression)) if is_set]
+    return f'{comparison.key:<32} x{comparison.ratio:<8.3f} {"REGRESSION " + ",".join(flags) if flags else "ok"}'
+
+
+def format_import_time(module: str, seconds: float, budget: float) -> str:
+    return f'import {module:<25} {seconds * 1000:>11.2f} ms {"OVER BUDGET " if seconds > budget else ""}' \
+           f'(budget {budget * 1000:.0f} ms)'
+
+
+def main(argv: tp.Optional[tp.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of all algorithms of the repository')
+    parser.add_argument('cases', nargs='*', help=f'cases to run, all by default: {", ".join(CASES)}')
+    parser.add_argument('--sizes', default=','.join(DEFAULT_DATA_SIZES),
+                        help='comma separated payload sizes, for example 1K,1M,100M')
+    parser.add_argument('--key-sizes', default=','.join(map(str, DEFAULT_KEY_SIZES)),
+                        help='comma separated modulus sizes in bits for RSA, ElGamal and DSA')
+    parser.add_argument('--curve-sizes', default=','.join(map(str, DEFAULT_CURVE_SIZES)),
+                        help='comma separated sizes of secpXXXr1 curves')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--in-process', action='store_true', help='do not run every case in its own process')
+    parser.add_argument('--engines', action='store_true', help='also compare EC multiplication engines')
+    parser.add_argument('--skip-imports', action='store_true', help='do not check import time budgets')
+    parser.add_argument('--save', help='path to store results as JSON baseline')
+    parser.add_argument('--baseline', help='path of JSON baseline to compare results with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    unknown_cases = set(args.cases) - set(CASES)
+    if unknown_cases:
+        parser.error(f'unknown cases: {", ".join(sorted(unknown_cases))}')
+    curve_sizes = [int(size) for size in args.curve_sizes.split(',')]
+    results = run_benchmarks(args.cases or None, [parse_size(size) for size in args.sizes.split(',')],
+                             [int(size) for size in args.key_sizes.split(',')], curve_sizes,
+                             args.repeats, not args.in_process, lambda result: print(format_result(result)))
+    if args.engines:
+        for result in run_engine_benchmarks(curve_sizes):
+            print(format_result(result))
+            results.append(result)
+
+    import_times = {} if args.skip_imports else check_import_budgets()
+    for module, (seconds, budget) in import_times.items():
+        print(format_import_time(module, seconds, budget))
+    is_over_budget = any(seconds > budget for seconds, budget in import_times.values())
+
+    if args.save:
+        save_baseline(results, args.save, import_times)
+    if args.baseline:
+        comparisons = compare(results, load_baseline(args.baseline), args.tolerance) + \
+            compare_import_times(import_times, load_baseline_import_times(args.baseline), args.tolerance)
+        print()
+        for comparison in comparisons:
+            print(format_comparison(comparison))
+        if any(comparison.is_time_regression or comparison.is_memory_regression for comparison in comparisons):
+            return 1
+    return 1 if is_over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import typing as tp
+
+import numpy as np
+from bitarray import bitarray
+
+from lab1_des import DesCipherConstParameters
+
+
+LANES = 64
+BLOCK_LENGTH = 64
+KEY_LENGTH = 56
+ROUNDS = 16
+# (whether stage encrypts, key of the stage)
+Stage = tp.Tuple[bool, bitarray]
+
+
+def bits_to_planes(bits: np.ndarray) -> np.ndarray:
+    """
+    Transposes blocks into bit planes: bit j of lane word w of plane i is bit i of block w * 64 + j
+    :param bits: array of shape (blocks amount, bits per block) with 0/1 values
+    :return: array of shape (bits per block, ceil(blocks amount / 64)) of uint64
+    """
+    blocks_amount, bits_amount = bits.shape
+    padded_bits = np.zeros((bits_amount, -(-blocks_amount // LANES) * LANES), dtype=np.uint8)
+    padded_bits[:, :blocks_amount] = bits.T
+    return np.packbits(padded_bits, axis=1, bitorder='little').view('<u8')
+
+
+def planes_to_bits(planes: np.ndarray, blocks_amount: int) -> np.ndarray:
+    """
+    Inverse of bits_to_planes
+    """
+    bits = np.unpackbits(np.ascontiguousarray(planes).view(np.uint8), axis=1, bitorder='little')
+    return bits[:, :blocks_amount].T
+
+
+def keys_to_planes(keys: tp.Sequence[bitarray]) -> np.ndarray:
+    """
+    :param keys: 56-bit keys, one per lane
+    :return: key planes of shape (56, ceil(len(keys) / 64))
+    """
+    bits = np.frombuffer(b''.join(key.tobytes() for key in keys), dtype=np.uint8).reshape(len(keys), -1)
+    return bits_to_planes(np.unpackbits(bits, axis=1)[:, :KEY_LENGTH])
+
+
+def key_to_planes(key: bitarray) -> np.ndarray:
+    """
+    :param key: 56-bit key (or any other bits) shared by all lanes
+    :return: planes of shape (56, 1), all ones or all zeros, broadcasted to any amount of lane words
+    """
+    return np.array([[np.uint64(0xFFFFFFFFFFFFFFFF) if bit else np.uint64(0)] for bit in key], dtype=np.uint64)
+
+
+def int_keys_to_planes(keys: np.ndarray) -> np.ndarray:
+    """
+    :param keys: 56-bit keys as integers, the highest bit is the first bit of the key bitarray
+    :return: key planes of shape (56, ceil(len(keys) / 64))
+    """
+    shifts = np.arange(KEY_LENGTH - 1, -1, -1, dtype=np.uint64)
+    return bits_to_planes(((keys.astype(np.uint64)[:, np.newaxis] >> shifts) & np.uint64(1)).astype(np.uint8))
+
+
+def block_to_planes(block: bytes) -> np.ndarray:
+    """
+    :param block: 8 byte block shared by all lanes
+    :return: block planes of shape (64, 1), broadcasted to any amount of lane words
+    """
+    bits = bitarray()
+    bits.frombytes(block)
+    return key_to_planes(bits)
+
+
+def planes_to_ints(planes: np.ndarray, blocks_amount: int) -> np.ndarray:
+    """
+    :return: blocks as big endian uint64 integers
+    """
+    return np.ascontiguousarray(np.packbits(planes_to_bits(planes, blocks_amount), axis=1)).view('>u8').ravel() \
+        .astype(np.uint64)
+
+
+class BitslicedDes:
+    """
+    Processes 64 blocks per uint64 lane word, whole arrays of lane words at once. The same const parameters
+    as in lab1_des.Des give the same results. Permutations and the extension become plane indexing,
+    key schedule is an index map from the key planes, S-boxes are evaluated with a decoder tree of
+    selectors, every output bit is OR of the selectors of inputs where it is set
+    """
+    def __init__(self, const_parameters: DesCipherConstParameters, chunk_blocks: int = 1 << 13) -> None:
+        """
+        :param const_parameters: permutations and S-boxes of the cipher
+        :param chunk_blocks: amount of blocks transposed and processed at once, bounds memory usage
+        """
+        self._ip_permutation = np.array(const_parameters.ip_permutation)
+        self._inverse_ip_permutation = np.argsort(self._ip_permutation)
+        self._e_permutation = np.array(const_parameters.e_permutation)
+        self._p_permutation = np.array(const_parameters.p_permutation)
+        self._subkey_indices = self._make_subkey_indices(const_parameters.pc_1_permutation,
+                                                         const_parameters.pc_2_permutation)
+        self._s_box_indices = self._make_s_box_indices(const_parameters.s_boxes)
+        self._chunk_blocks = max(LANES, chunk_blocks - chunk_blocks % LANES)
+
+    @staticmethod
+    def _make_subkey_indices(pc_1_permutation: tp.List[int], pc_2_permutation: tp.List[int]) -> np.ndarray:
+        """
+        Runs Des key schedule on key bit numbers instead of key bits
+        :return: array of shape (16, 48), bit j of round i subkey is key bit [i, j]
+        """
+        key_bits = list(pc_1_permutation)
+        left_part, right_part = key_bits[:28], key_bits[28:]
+        result = []
+        for round_no in range(ROUNDS):
+            shift = round_no % 2 + 1
+            left_part = left_part[shift:] + left_part[:shift]
+            right_part = right_part[shift:] + right_part[:shift]
+            result.append([(left_part + right_part)[position] for position in pc_2_permutation])
+        return np.array(result)
+
+    @staticmethod
+    def _make_s_box_indices(s_boxes: tp.List[tp.List[tp.List[int]]]) -> np.ndarray:
+        """
+        Selectors of all S-boxes are stored in one array of shape (8 * 64 + 1, lane words), the last row is zero
+        :return: array of shape (32, n), output bit i is OR of selectors with numbers from row i
+        """
+        selectors = [[] for _ in range(32)]
+        for s_box_no, s_box in enumerate(s_boxes):
+            for value in range(64):
+                output = s_box[value >> 4][value & 15]
+                for bit_no in range(4):
+                    if (output >> (3 - bit_no)) & 1:
+                        selectors[s_box_no * 4 + bit_no].append(s_box_no * 64 + value)
+        width = max(map(len, selectors))
+        return np.array([row + [8 * 64] * (width - len(row)) for row in selectors])
+
+    def _substitute(self, planes: np.ndarray) -> np.ndarray:
+        """
+        :param planes: 48 planes, 6 inputs of every S-box, first of them is the highest bit of the row
+        :return: 32 output planes
+        """
+        lane_words = planes.shape[1]
+        inputs = planes.reshape(8, 6, lane_words)
+        selectors = np.full((8, 1, lane_words), np.uint64(0xFFFFFFFFFFFFFFFF), dtype=np.uint64)
+        for bit_no in range(6):
+            bit = inputs[:, bit_no: bit_no + 1]
+            selectors = np.stack((selectors & ~bit, selectors & bit), axis=2).reshape(8, -1, lane_words)
+        selectors = np.concatenate((selectors.reshape(8 * 64, lane_words), np.zeros((1, lane_words), np.uint64)))
+        return np.bitwise_or.reduce(selectors[self._s_box_indices], axis=1)
+
+    def _feistel_function(self, block_part: np.ndarray, subkey: np.ndarray) -> np.ndarray:
+        return self._substitute(block_part[self._e_permutation] ^ subkey)[self._p_permutation]
+
+    def _encrypt_planes(self, planes: np.ndarray, key_planes: np.ndarray) -> np.ndarray:
+        planes = planes[self._ip_permutation]
+        left_part, right_part = planes[:32], planes[32:]
+        for round_no in range(ROUNDS):
+            subkey = key_planes[self._subkey_indices[round_no]]
+            left_part, right_part = right_part, left_part ^ self._feistel_function(right_part, subkey)
+        return np.concatenate((left_part, right_part))[self._inverse_ip_permutation]
+
+    def _decrypt_planes(self, planes: np.ndarray, key_planes: np.ndarray) -> np.ndarray:
+        planes = planes[self._ip_permutation]
+        left_part, right_part = planes[:32], planes[32:]
+        for round_no in reversed(range(ROUNDS)):
+            subkey = key_planes[self._subkey_indices[round_no]]
+            left_part, right_part = right_part ^ self._feistel_function(left_part, subkey), left_part
+        return np.concatenate((left_part, right_part))[self._inverse_ip_permutation]
+
+    def process_planes(self, planes: np.ndarray, stages: tp.Sequence[tp.Tuple[bool, np.ndarray]]) -> np.ndarray:
+        """
+        :param planes: 64 block planes
+        :param stages: (whether stage encrypts, key planes) for every pass of the cipher
+        :return: 64 block planes
+        """
+        for is_encryption, key_planes in stages:
+            planes = (self._encrypt_planes if is_encryption else self._decrypt_planes)(planes, key_planes)
+        return planes
+
+    def process_into(self, data: tp.Any, output: tp.Union[bytearray, memoryview],
+                     stages: tp.Sequence[Stage]) -> None:
+        """
+        Runs blocks through several encryptions and decryptions without transposing them between the stages,
+        for example E(k1), D(k2), E(k1) for TripleDes. Processed chunks are written straight into the output
+        :param data: bytes-like object of whole 8 byte blocks
+        :param output: writable buffer of the same length
+        :param stages: (whether stage encrypts, 56-bit key) for every pass of the cipher
+        """
+        blocks = np.frombuffer(data, dtype=np.uint8)
+        if len(blocks) % (BLOCK_LENGTH // 8) != 0:
+            raise ValueError('Data should consist of whole blocks')
+        blocks = blocks.reshape(-1, BLOCK_LENGTH // 8)
+        result = np.frombuffer(output, dtype=np.uint8)[:blocks.size].reshape(blocks.shape)
+        key_stages = [(is_encryption, key_to_planes(key)) for is_encryption, key in stages]
+        for start in range(0, len(blocks), self._chunk_blocks):
+            chunk = blocks[start: start + self._chunk_blocks]
+            planes = self.process_planes(bits_to_planes(np.unpackbits(chunk, axis=1)), key_stages)
+            result[start: start + len(chunk)] = np.packbits(planes_to_bits(planes, len(chunk)), axis=1)
+
+    def process(self, data: bytes, stages: tp.Sequence[Stage]) -> bytes:
+        """
+        :param data: whole 8 byte blocks
+        :param stages: (whether stage encrypts, 56-bit key) for every pass of the cipher
+        :return: processed blocks
+        """
+        output = bytearray(len(data))
+        self.process_into(data, output, stages)
+        return bytes(output)
+
+    def encrypt(self, data: bytes, key: bitarray) -> bytes:
+        return self.process(data, [(True, key)])
+
+    def decrypt(self, data: bytes, key: bitarray) -> bytes:
+        return self.process(data, [(False, key)])
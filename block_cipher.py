@@ -3,6 +3,8 @@ import typing as tp
 from abc import abstractmethod
 from bitarray import bitarray
 
+from functions import read_bits, write_bits
+
 
 class BlockCipher:
     def __init_subclass__(cls, /, message_block_length: int, **kwargs) -> None:
@@ -17,34 +19,92 @@ class BlockCipher:
     def _decrypt_block(self, message: bitarray) -> bitarray:
         pass
 
+    @property
+    def block_length(self) -> int:
+        """
+        :return: block length in bytes
+        """
+        return self._message_block_length // 8
+
+    def get_encrypted_length(self, length: int) -> int:
+        """
+        :param length: plain text length in bytes
+        :return: cipher text length in bytes, the last incomplete block is padded
+        """
+        return -(-length // self.block_length) * self.block_length
+
+    def _process_into(self, source: memoryview, destination: memoryview, is_encryption: bool) -> None:
+        """
+        Bulk hook, ciphers with faster engines for many blocks override it
+        :param source: whole blocks
+        :param destination: buffer of the same length
+        """
+        process_block = self._encrypt_block if is_encryption else self._decrypt_block
+        for offset in range(0, len(source), self.block_length):
+            block = bitarray()
+            block.frombytes(source[offset: offset + self.block_length])
+            destination[offset: offset + self.block_length] = process_block(block).tobytes()
+
+    def encrypt_into(self, source: tp.Any, destination: tp.Union[bytearray, memoryview]) -> int:
+        """
+        Encrypts any bytes-like object into a preallocated buffer, the last incomplete block is padded with zeros
+        :param source: plain text
+        :param destination: writable buffer of at least get_encrypted_length(len(source)) bytes
+        :return: amount of bytes written
+        """
+        source, destination = memoryview(source).cast('B'), memoryview(destination).cast('B')
+        length = self.get_encrypted_length(len(source))
+        if len(destination) < length:
+            raise ValueError(f'Destination should have at least {length} bytes')
+        whole_length = len(source) - len(source) % self.block_length
+        self._process_into(source[:whole_length], destination[:whole_length], True)
+        if whole_length < length:
+            last_block = bitarray()
+            last_block.frombytes(source[whole_length:])
+            self._process_into(memoryview(self._pad_block(last_block).tobytes()), destination[whole_length: length],
+                               True)
+        return length
+
+    def decrypt_into(self, source: tp.Any, destination: tp.Union[bytearray, memoryview]) -> int:
+        """
+        Decrypts any bytes-like object into a preallocated buffer, the last incomplete block is dropped
+        :param source: cipher text
+        :param destination: writable buffer of at least len(source) rounded down to whole blocks bytes
+        :return: amount of bytes written
+        """
+        source, destination = memoryview(source).cast('B'), memoryview(destination).cast('B')
+        length = len(source) - len(source) % self.block_length
+        if len(destination) < length:
+            raise ValueError(f'Destination should have at least {length} bytes')
+        self._process_into(source[:length], destination[:length], False)
+        return length
+
     def encrypt(self, message: bitarray) -> bitarray:
+        data = message.tobytes()
+        result = bytearray(self.get_encrypted_length(len(data)))
+        self.encrypt_into(data, result)
         encrypted_message = bitarray()
-        for i in range(len(message) // self._message_block_length):
-            encrypted_message.extend(
-                self._encrypt_block(message[i * self._message_block_length: (i + 1) * self._message_block_length]))
-        if len(message) % self._message_block_length != 0:
-            last_block = message[(len(message) // self._message_block_length) * self._message_block_length:]
-            last_block.extend([0] * (self._message_block_length - (len(message) % self._message_block_length)))
-            encrypted_message.extend(self._encrypt_block(last_block))
+        encrypted_message.frombytes(result)
         return encrypted_message
 
+    def _pad_block(self, block: bitarray) -> bitarray:
+        block.extend([0] * (self._message_block_length - len(block)))
+        return block
+
     def decrypt(self, message: bitarray) -> bitarray:
+        data = message.tobytes()
+        result = bytearray(len(data) - len(data) % self.block_length)
+        self.decrypt_into(data, result)
         decrypted_message = bitarray()
-        for i in range(len(message) // self._message_block_length):
-            decrypted_message.extend(
-                self._decrypt_block(message[i * self._message_block_length: (i + 1) * self._message_block_length]))
+        decrypted_message.frombytes(result)
         return decrypted_message
 
     def encrypt_file(self, input_file: tp.BinaryIO, output_file: tp.BinaryIO) -> int:
-        input_file_message = bitarray()
-        input_file_message.fromfile(input_file)
-        encrypted_file_message = self.encrypt(input_file_message)
-        encrypted_file_message.tofile(output_file)
+        input_file_message = read_bits(input_file)
+        write_bits(self.encrypt(input_file_message), output_file)
         return len(input_file_message)
 
     def decrypt_file(self, input_file: tp.BinaryIO, output_file: tp.BinaryIO,
                      initial_message_length: tp.Optional[int] = None) -> None:
-        input_file_message = bitarray()
-        input_file_message.fromfile(input_file)
-        decrypted_file_message = self.decrypt(input_file_message)
-        decrypted_file_message[slice(None, initial_message_length)].tofile(output_file)
+        decrypted_file_message = self.decrypt(read_bits(input_file))
+        write_bits(decrypted_file_message[slice(None, initial_message_length)], output_file)
@@ -0,0 +1,130 @@
+import typing as tp
+import argparse
+import os
+import sys
+
+from block_cipher import BlockCipher
+from streaming import CIPHER_ALGORITHMS, DEFAULT_CHUNK_SIZE, ReadAhead, WriteBehind, encrypt_bytes, generate_key, \
+    get_chunk_size, load_cipher, xor_with_keystream
+
+
+MODES = ('ecb', 'ctr')
+
+
+def _pad(chunk: bytes, block_length: int) -> bytes:
+    # ISO/IEC 7816-4: 0x80 and zeros, always at least one byte, so it can be removed unambiguously
+    chunk += b'\x80'
+    return chunk + bytes(-len(chunk) % block_length)
+
+
+def _unpad(chunk: tp.Union[bytes, bytearray]) -> tp.Union[bytes, bytearray]:
+    stripped = chunk.rstrip(b'\x00')
+    if not stripped.endswith(b'\x80'):
+        raise ValueError('Wrong padding, the key is wrong or the data is corrupted')
+    return stripped[:-1]
+
+
+def encrypt_stream(cipher: BlockCipher, input_file: tp.BinaryIO, output_file: tp.BinaryIO, mode: str = 'ecb',
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """
+    Encrypts the whole input chunk by chunk, memory usage doesn't depend on the input size
+    :param cipher: cipher to use
+    :param input_file: binary file to read plain text from
+    :param output_file: binary file to write cipher text to
+    :param mode: 'ecb' - blocks are encrypted independently, the last one is padded,
+        'ctr' - plain text is xored with encrypted counters, random nonce is written before the cipher text
+    :param chunk_size: amount of bytes processed at once, rounded down to whole blocks
+    """
+    block_length = cipher.block_length
+    chunk_size = get_chunk_size(cipher, chunk_size)
+    writer = WriteBehind(output_file)
+    try:
+        if mode == 'ctr':
+            nonce = os.urandom(block_length // 2)
+            writer.write(nonce)
+            for chunk_no, (chunk, _) in enumerate(ReadAhead(input_file, chunk_size)):
+                writer.write(xor_with_keystream(cipher, nonce, chunk_no * chunk_size // block_length, chunk))
+        else:
+            is_padded = False
+            for chunk, is_last in ReadAhead(input_file, chunk_size):
+                if is_last:
+                    chunk = _pad(chunk, block_length)
+                    is_padded = True
+                writer.write(encrypt_bytes(cipher, chunk))
+            if not is_padded:
+                writer.write(encrypt_bytes(cipher, _pad(b'', block_length)))
+    finally:
+        writer.close()
+
+
+def decrypt_stream(cipher: BlockCipher, input_file: tp.BinaryIO, output_file: tp.BinaryIO, mode: str = 'ecb',
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """
+    Inverse of encrypt_stream, the same mode and chunk size independent
+    """
+    block_length = cipher.block_length
+    chunk_size = get_chunk_size(cipher, chunk_size)
+    writer = WriteBehind(output_file)
+    try:
+        if mode == 'ctr':
+            nonce = input_file.read(block_length // 2)
+            if len(nonce) != block_length // 2:
+                raise ValueError('Input is too short to contain a nonce')
+            for chunk_no, (chunk, _) in enumerate(ReadAhead(input_file, chunk_size)):
+                writer.write(xor_with_keystream(cipher, nonce, chunk_no * chunk_size // block_length, chunk))
+        else:
+            is_unpadded = False
+            for chunk, is_last in ReadAhead(input_file, chunk_size):
+                if len(chunk) % block_length != 0:
+                    raise ValueError('Input length is not a multiple of the block length')
+                decrypted_chunk = bytearray(len(chunk))
+                cipher.decrypt_into(chunk, decrypted_chunk)
+                if is_last:
+                    decrypted_chunk = _unpad(decrypted_chunk)
+                    is_unpadded = True
+                writer.write(decrypted_chunk)
+            if not is_unpadded:
+                raise ValueError('Input is empty')
+    finally:
+        writer.close()
+
+
+def main(argv: tp.Optional[tp.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='mzi', description='Streams stdin through a block cipher to stdout')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    genkey_parser = subparsers.add_parser('genkey', help='generate key file')
+    genkey_parser.add_argument('--alg', choices=CIPHER_ALGORITHMS, required=True)
+    genkey_parser.add_argument('-o', '--output', help='key file path, stdout by default')
+
+    for command in ('encrypt', 'decrypt'):
+        command_parser = subparsers.add_parser(command, help=f'{command} stdin to stdout')
+        command_parser.add_argument('--alg', choices=CIPHER_ALGORITHMS, required=True)
+        command_parser.add_argument('--key', required=True, help='key file made by genkey')
+        command_parser.add_argument('--mode', choices=MODES, default='ecb')
+        command_parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    args = parser.parse_args(argv)
+    if args.command == 'genkey':
+        key_data = generate_key(args.alg)
+        if args.output is None:
+            sys.stdout.buffer.write(key_data)
+            sys.stdout.buffer.flush()
+        else:
+            with open(args.output, 'wb') as f:
+                f.write(key_data)
+        return 0
+
+    process_stream = encrypt_stream if args.command == 'encrypt' else decrypt_stream
+    try:
+        with open(args.key, 'rb') as f:
+            cipher = load_cipher(args.alg, f.read())
+        process_stream(cipher, sys.stdin.buffer, sys.stdout.buffer, args.mode, args.chunk_size)
+    except (KeyError, OSError, TypeError, ValueError) as e:
+        print(f'mzi: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import typing as tp
+import argparse
+import dataclasses
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from bitarray import bitarray
+from bitarray.util import ba2int, int2ba
+
+from bitsliced_des import BitslicedDes, block_to_planes, int_keys_to_planes, planes_to_ints
+from lab1_des import Des, DesCipherConstParameters
+
+
+KEY_LENGTH = 56
+TABLE_VALUES_FILE = 'values.npy'
+TABLE_KEYS_FILE = 'keys.npy'
+TABLE_META_FILE = 'meta.json'
+
+
+@dataclasses.dataclass
+class MitmReport:
+    key_bits: int
+    table_entries: int
+    table_seconds: float
+    probes: int
+    probe_seconds: float
+    candidates: tp.List[tp.Tuple[bitarray, bitarray]]
+
+    @property
+    def table_rate(self) -> float:
+        return self.table_entries / self.table_seconds if self.table_seconds else 0.
+
+    @property
+    def probe_rate(self) -> float:
+        return self.probes / self.probe_seconds if self.probe_seconds else 0.
+
+
+def key_from_index(index: int, key_bits: int, base_key: int = 0) -> bitarray:
+    """
+    Reduced key space: the lowest key_bits bits of the key are unknown, the rest are taken from base_key
+    """
+    mask = (1 << key_bits) - 1
+    return int2ba((base_key & ~mask) | index, length=KEY_LENGTH)
+
+
+def _keys_from_indices(indices: np.ndarray, key_bits: int, base_key: int) -> np.ndarray:
+    mask = (1 << key_bits) - 1
+    return np.uint64(base_key & ~mask & ((1 << KEY_LENGTH) - 1)) | indices.astype(np.uint64)
+
+
+def _process_keys(engine: BitslicedDes, block: bytes, is_encryption: bool, start: int, stop: int,
+                  key_bits: int, base_key: int) -> np.ndarray:
+    """
+    :return: the block encrypted (or decrypted) with keys number start..stop-1 of the reduced key space
+    """
+    keys = _keys_from_indices(np.arange(start, stop, dtype=np.uint64), key_bits, base_key)
+    planes = engine.process_planes(block_to_planes(block), [(is_encryption, int_keys_to_planes(keys))])
+    return planes_to_ints(planes, stop - start)
+
+
+_worker_state: tp.Dict[str, tp.Any] = {}
+
+
+def _init_probe_worker(const_parameters: DesCipherConstParameters, table_dir: str) -> None:
+    _worker_state['engine'] = BitslicedDes(const_parameters)
+    _worker_state['values'] = np.load(os.path.join(table_dir, TABLE_VALUES_FILE), mmap_mode='r')
+    _worker_state['keys'] = np.load(os.path.join(table_dir, TABLE_KEYS_FILE), mmap_mode='r')
+
+
+def _probe_range(ciphertext: bytes, start: int, stop: int, key_bits: int,
+                 base_key: int) -> tp.List[tp.Tuple[int, int]]:
+    """
+    :return: (first key index, second key index) pairs, which map the known plain text to the cipher text
+    """
+    values, keys = _worker_state['values'], _worker_state['keys']
+    probes = _process_keys(_worker_state['engine'], ciphertext, True, start, stop, key_bits, base_key)
+    left = np.searchsorted(values, probes, side='left')
+    right = np.searchsorted(values, probes, side='right')
+    return [(start + int(probe_no), int(second_key_index))
+            for probe_no in np.nonzero(right > left)[0]
+            for second_key_index in keys[left[probe_no]: right[probe_no]]]
+
+
+class DoubleDesMitmAttack:
+    """
+    Meet in the middle attack on DoubleDes, which computes C = D_k1(D_k2(P)).
+    For every k2 the table stores D_k2(P) sorted, for every k1 E_k1(C) is looked up in it,
+    so the attack needs 2 * 2^key_bits Des operations instead of 2^(2 * key_bits)
+    """
+    def __init__(self, const_parameters: DesCipherConstParameters, key_bits: int, base_key: int = 0,
+                 table_dir: tp.Optional[str] = None, chunk_keys: int = 1 << 16,
+                 workers: tp.Optional[int] = None) -> None:
+        """
+        :param const_parameters: parameters of the attacked cipher
+        :param key_bits: amount of unknown lowest bits of both keys
+        :param base_key: known highest bits of both keys
+        :param table_dir: directory for the table files, a temporary one by default, it is removed by close
+        :param chunk_keys: amount of keys processed by the engine at once
+        :param workers: amount of probing processes, os.cpu_count() by default
+        """
+        if not 0 < key_bits <= 32:
+            raise ValueError('key_bits should be from 1 to 32')
+        self.const_parameters = const_parameters
+        self.key_bits = key_bits
+        self.base_key = base_key
+        self._owns_table_dir = table_dir is None
+        self.table_dir = tempfile.mkdtemp(prefix='double_des_mitm_') if table_dir is None else table_dir
+        self.chunk_keys = chunk_keys
+        self.workers = workers
+        self._engine = BitslicedDes(const_parameters)
+
+    def __enter__(self) -> 'DoubleDesMitmAttack':
+        return self
+
+    def __exit__(self, *exc_info: tp.Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Removes the table directory if it was created by the attack, a directory passed by the caller is kept
+        """
+        if self._owns_table_dir:
+            shutil.rmtree(self.table_dir, ignore_errors=True)
+            self._owns_table_dir = False
+
+    def build_table(self, plaintext: bytes) -> float:
+        """
+        Writes sorted D_k2(plaintext) values and corresponding key indices into memory mapped .npy files
+        :param plaintext: known 8 byte plain text
+        :return: seconds spent
+        """
+        start_time = time.perf_counter()
+        os.makedirs(self.table_dir, exist_ok=True)
+        entries = 1 << self.key_bits
+        values_path = os.path.join(self.table_dir, TABLE_VALUES_FILE)
+        values = np.lib.format.open_memmap(values_path, mode='w+', dtype=np.uint64, shape=(entries,))
+        for start in range(0, entries, self.chunk_keys):
+            stop = min(entries, start + self.chunk_keys)
+            values[start: stop] = _process_keys(self._engine, plaintext, False, start, stop, self.key_bits,
+                                                self.base_key)
+        order = np.argsort(values, kind='stable')
+        keys = np.lib.format.open_memmap(os.path.join(self.table_dir, TABLE_KEYS_FILE), mode='w+',
+                                         dtype=np.uint32, shape=(entries,))
+        keys[:] = order
+        values[:] = values[order]
+        values.flush()
+        keys.flush()
+        del values, keys, order
+        with open(os.path.join(self.table_dir, TABLE_META_FILE), 'w') as f:
+            json.dump({'key_bits': self.key_bits, 'base_key': self.base_key, 'plaintext': plaintext.hex()}, f)
+        return time.perf_counter() - start_time
+
+    def probe(self, ciphertext: bytes) -> tp.Tuple[tp.List[tp.Tuple[int, int]], float]:
+        """
+        :param ciphertext: 8 byte cipher text of the plain text given to build_table
+        :return: (k1 index, k2 index) candidates and seconds spent
+        """
+        start_time = time.perf_counter()
+        entries = 1 << self.key_bits
+        ranges = [(start, min(entries, start + self.chunk_keys)) for start in range(0, entries, self.chunk_keys)]
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_probe_worker,
+                                 initargs=(self.const_parameters, self.table_dir)) as executor:
+            futures = [executor.submit(_probe_range, ciphertext, start, stop, self.key_bits, self.base_key)
+                       for start, stop in ranges]
+            candidates = [candidate for future in futures for candidate in future.result()]
+        return candidates, time.perf_counter() - start_time
+
+    def attack(self, plaintext: bytes, ciphertext: bytes,
+               verification_pairs: tp.Sequence[tp.Tuple[bytes, bytes]] = ()) -> MitmReport:
+        """
+        :param plaintext: known 8 byte plain text
+        :param ciphertext: its cipher text
+        :param verification_pairs: other known (plain text, cipher text) blocks, candidates must match all of them
+        :return: report with candidate (k1, k2) pairs and table building and probing rates
+        """
+        table_seconds = self.build_table(plaintext)
+        candidates, probe_seconds = self.probe(ciphertext)
+        keys = [(key_from_index(first, self.key_bits, self.base_key),
+                 key_from_index(second, self.key_bits, self.base_key)) for first, second in candidates]
+        if verification_pairs:
+            des = Des(self.const_parameters, bitarray(KEY_LENGTH))
+            keys = [(first_key, second_key) for first_key, second_key in keys
+                    if all(self._double_des_encrypt(des, first_key, second_key, plain) == cipher
+                           for plain, cipher in verification_pairs)]
+        return MitmReport(self.key_bits, 1 << self.key_bits, table_seconds, 1 << self.key_bits, probe_seconds, keys)
+
+    @staticmethod
+    def _double_des_encrypt(des: Des, first_key: bitarray, second_key: bitarray, block: bytes) -> bytes:
+        message = bitarray()
+        message.frombytes(block)
+        des.change_key(second_key)
+        message = des.decrypt(message)
+        des.change_key(first_key)
+        return des.decrypt(message).tobytes()
+
+
+def main(argv: tp.Optional[tp.Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Meet in the middle key recovery for DoubleDes')
+    parser.add_argument('--key-bits', type=int, default=18, help='amount of unknown bits of each key')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--table-dir', default=None)
+    args = parser.parse_args(argv)
+
+    from lab1_double_des import DoubleDes
+    const_parameters = Des.generate_parameters()
+    base_key = secrets.randbits(KEY_LENGTH)
+    first_key, second_key = (key_from_index(secrets.randbits(args.key_bits), args.key_bits, base_key)
+                             for _ in range(2))
+    cipher = DoubleDes(const_parameters, first_key, second_key)
+    pairs = []
+    for _ in range(3):
+        block = secrets.token_bytes(8)
+        message = bitarray()
+        message.frombytes(block)
+        pairs.append((block, cipher.encrypt(message).tobytes()))
+
+    with DoubleDesMitmAttack(const_parameters, args.key_bits, base_key, args.table_dir,
+                             workers=args.workers) as attack:
+        report = attack.attack(*pairs[0], verification_pairs=pairs[1:])
+    print(f'table: {report.table_entries} entries in {report.table_seconds:.2f} s ({report.table_rate:.0f} keys/s)')
+    print(f'probe: {report.probes} keys in {report.probe_seconds:.2f} s ({report.probe_rate:.0f} keys/s)')
+    print(f'recovered: {[(ba2int(k1), ba2int(k2)) for k1, k2 in report.candidates]}, '
+          f'actual: {(ba2int(first_key), ba2int(second_key))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,495 @@
+import typing as tp
+import threading
+
+from collections import OrderedDict
+from functools import lru_cache
+
+
+# affine points are (x, y) tuples, None stands for the point at infinity
+AffinePoint = tp.Optional[tp.Tuple[int, int]]
+# Jacobian point (X, Y, Z) represents affine point (X / Z^2, Y / Z^3), Z = 0 for the point at infinity
+JacobianPoint = tp.Tuple[int, int, int]
+
+INFINITY: JacobianPoint = (1, 1, 0)
+
+
+class CurveArithmetic:
+    """
+    Point arithmetic of the curve y^2 = x^3 + ax + b over F_p.
+    Intermediate results are kept in Jacobian coordinates, so additions and doublings need no modular
+    inversion, and the only inversion is made when the result is converted back to affine coordinates
+    """
+    fixed_base_window = 4
+    # windows of precomputed odd multiples used by linear_combination
+    generator_wnaf_width = 8
+    cached_point_wnaf_width = 6
+    precomputation_cache_size = 256
+
+    def __init__(self, p: int, a: int, b: int, n: tp.Optional[int] = None,
+                 g: tp.Optional[tp.Tuple[int, int]] = None) -> None:
+        """
+        :param p: prime field modulus
+        :param a: curve coefficient
+        :param b: curve coefficient
+        :param n: order of the generator, if known
+        :param g: generator of the curve, if any
+        """
+        self.p = p
+        self.a = a % p
+        self.b = b % p
+        self.n = n
+        self.g = g
+        self._a_is_minus_3 = self.a == p - 3
+        self._generator_table: tp.Optional[tp.List[tp.List[tp.Tuple[int, int]]]] = None
+        self._generator_table_lock = threading.Lock()
+        # the generator is used all the time, its odd multiples are kept outside of the LRU cache
+        self._generator_odd_multiples: tp.Optional[tp.List[tp.Tuple[int, int]]] = None
+        self._odd_multiples_cache: 'OrderedDict[tp.Tuple[int, int], tp.List[tp.Tuple[int, int]]]' = OrderedDict()
+        self._odd_multiples_cache_lock = threading.Lock()
+
+    def is_on_curve(self, point: AffinePoint) -> bool:
+        if point is None:
+            return True
+        x, y = point
+        return (y * y - x * x * x - self.a * x - self.b) % self.p == 0
+
+    def negate(self, point: AffinePoint) -> AffinePoint:
+        if point is None:
+            return None
+        return point[0], -point[1] % self.p
+
+    @staticmethod
+    def to_jacobian(point: AffinePoint) -> JacobianPoint:
+        if point is None:
+            return INFINITY
+        return point[0], point[1], 1
+
+    def to_affine(self, point: JacobianPoint) -> AffinePoint:
+        x, y, z = point
+        if z == 0:
+            return None
+        z_inverse = pow(z, -1, self.p)
+        z_inverse_squared = z_inverse * z_inverse % self.p
+        return x * z_inverse_squared % self.p, y * z_inverse_squared * z_inverse % self.p
+
+    def to_affine_batch(self, points: tp.Sequence[JacobianPoint]) -> tp.List[AffinePoint]:
+        """
+        Converts many points at once with Montgomery's simultaneous inversion trick:
+        one inversion and three multiplications per point instead of an inversion per point
+        """
+        p = self.p
+        prefix_products = []
+        accumulator = 1
+        for _, _, z in points:
+            prefix_products.append(accumulator)
+            if z != 0:
+                accumulator = accumulator * z % p
+        accumulator_inverse = pow(accumulator, -1, p)
+        result: tp.List[AffinePoint] = [None] * len(points)
+        for index in range(len(points) - 1, -1, -1):
+            x, y, z = points[index]
+            if z == 0:
+                continue
+            z_inverse = accumulator_inverse * prefix_products[index] % p
+            accumulator_inverse = accumulator_inverse * z % p
+            z_inverse_squared = z_inverse * z_inverse % p
+            result[index] = x * z_inverse_squared % p, y * z_inverse_squared * z_inverse % p
+        return result
+
+    def double(self, point: JacobianPoint) -> JacobianPoint:
+        x, y, z = point
+        p = self.p
+        if z == 0 or y == 0:
+            return INFINITY
+        yy = y * y % p
+        s = 4 * x * yy % p
+        zz = z * z % p
+        if self._a_is_minus_3:
+            m = 3 * (x - zz) * (x + zz) % p
+        else:
+            m = (3 * x * x + self.a * zz * zz) % p
+        x3 = (m * m - 2 * s) % p
+        y3 = (m * (s - x3) - 8 * yy * yy) % p
+        z3 = 2 * y * z % p
+        return x3, y3, z3
+
+    def add(self, first: JacobianPoint, second: JacobianPoint) -> JacobianPoint:
+        x1, y1, z1 = first
+        x2, y2, z2 = second
+        if z1 == 0:
+            return second
+        if z2 == 0:
+            return first
+        p = self.p
+        z1z1 = z1 * z1 % p
+        z2z2 = z2 * z2 % p
+        u1 = x1 * z2z2 % p
+        u2 = x2 * z1z1 % p
+        s1 = y1 * z2 * z2z2 % p
+        s2 = y2 * z1 * z1z1 % p
+        h = (u2 - u1) % p
+        r = (s2 - s1) % p
+        if h == 0:
+            return self.double(first) if r == 0 else INFINITY
+        hh = h * h % p
+        hhh = h * hh % p
+        v = u1 * hh % p
+        x3 = (r * r - hhh - 2 * v) % p
+        y3 = (r * (v - x3) - s1 * hhh) % p
+        z3 = z1 * z2 * h % p
+        return x3, y3, z3
+
+    def add_mixed(self, first: JacobianPoint, second: tp.Tuple[int, int]) -> JacobianPoint:
+        """
+        Addition of a Jacobian point and an affine point (Z = 1), which saves several multiplications
+        """
+        x1, y1, z1 = first
+        x2, y2 = second
+        if z1 == 0:
+            return x2, y2, 1
+        p = self.p
+        z1z1 = z1 * z1 % p
+        u2 = x2 * z1z1 % p
+        s2 = y2 * z1 * z1z1 % p
+        h = (u2 - x1) % p
+        r = (s2 - y1) % p
+        if h == 0:
+            return self.double(first) if r == 0 else INFINITY
+        hh = h * h % p
+        hhh = h * hh % p
+        v = x1 * hh % p
+        x3 = (r * r - hhh - 2 * v) % p
+        y3 = (r * (v - x3) - y1 * hhh) % p
+        z3 = z1 * h % p
+        return x3, y3, z3
+
+    def _reduce_scalar(self, k: int) -> int:
+        return k % self.n if self.n is not None else k
+
+    @staticmethod
+    def _wnaf(k: int, width: int) -> tp.List[int]:
+        """
+        Width-w non-adjacent form: odd digits in (-2^(w-1), 2^(w-1)), at most one of any w consecutive ones is non-zero
+        :return: digits, least significant first
+        """
+        digits = []
+        while k > 0:
+            digit = 0
+            if k & 1:
+                digit = k & ((1 << width) - 1)
+                if digit >= 1 << (width - 1):
+                    digit -= 1 << width
+                k -= digit
+            digits.append(digit)
+            k >>= 1
+        return digits
+
+    def _odd_multiples(self, point: tp.Tuple[int, int], width: int) -> tp.List[tp.Tuple[int, int]]:
+        """
+        :return: affine points P, 3P, 5P, ..., (2^(w-1) - 1)P
+        """
+        doubled = self.double(self.to_jacobian(point))
+        multiples = [self.to_jacobian(point)]
+        for _ in range((1 << (width - 2)) - 1):
+            multiples.append(self.add(multiples[-1], doubled))
+        return self.to_affine_batch(multiples)
+
+    @staticmethod
+    def _wnaf_width(bits_amount: int) -> int:
+        if bits_amount > 192:
+            return 5
+        if bits_amount > 64:
+            return 4
+        return 3
+
+    def multiply(self, point: AffinePoint, k: int) -> AffinePoint:
+        """
+        Variable base multiplication: wNAF double-and-add with mixed additions of precomputed odd multiples
+        :param point: point to multiply
+        :param k: scalar, negative values are allowed
+        :return: k * point
+        """
+        if point is None:
+            return None
+        if k < 0:
+            point, k = self.negate(point), -k
+        k = self._reduce_scalar(k)
+        if k == 0:
+            return None
+        width = self._wnaf_width(k.bit_length())
+        multiples = self._odd_multiples(point, width)
+        if None in multiples:
+            return self._multiply_double_and_add(point, k)
+        negated_multiples = [self.negate(multiple) for multiple in multiples]
+        result = INFINITY
+        for digit in reversed(self._wnaf(k, width)):
+            result = self.double(result)
+            if digit > 0:
+                result = self.add_mixed(result, multiples[digit >> 1])
+            elif digit < 0:
+                result = self.add_mixed(result, negated_multiples[(-digit) >> 1])
+        return self.to_affine(result)
+
+    def _multiply_double_and_add(self, point: tp.Tuple[int, int], k: int) -> AffinePoint:
+        """
+        Plain double-and-add, used for points of small order, whose odd multiples can be infinite
+        """
+        result = INFINITY
+        for bit_no in range(k.bit_length() - 1, -1, -1):
+            result = self.double(result)
+            if (k >> bit_no) & 1:
+                result = self.add_mixed(result, point)
+        return self.to_affine(result)
+
+    def _ladder_add(self, first: tp.Tuple[int, int], second: tp.Tuple[int, int], difference_x: int) -> \
+            tp.Tuple[int, int]:
+        """
+        x-only differential addition (Brier-Joye) of points (X:Z), whose difference has affine x coordinate difference_x
+        """
+        p = self.p
+        x1, z1 = first
+        x2, z2 = second
+        x1z2 = x1 * z2 % p
+        x2z1 = x2 * z1 % p
+        z1z2 = z1 * z2 % p
+        x3 = (2 * (x1z2 + x2z1) * (x1 * x2 + self.a * z1z2) + 4 * self.b * z1z2 * z1z2
+              - difference_x * (x1z2 - x2z1) ** 2) % p
+        z3 = (x1z2 - x2z1) ** 2 % p
+        return x3, z3
+
+    def _ladder_double(self, point: tp.Tuple[int, int]) -> tp.Tuple[int, int]:
+        p = self.p
+        x, z = point
+        xx = x * x % p
+        zz = z * z % p
+        x3 = ((xx - self.a * zz) ** 2 - 8 * self.b * x * zz * z) % p
+        z3 = 4 * z * (xx * x + self.a * x * zz + self.b * zz * z) % p
+        return x3, z3
+
+    def ladder_multiply(self, point: AffinePoint, k: int) -> AffinePoint:
+        """
+        Montgomery ladder on x coordinates only: every bit of the scalar costs exactly one differential
+        addition and one doubling, the bit only decides which registers are swapped (with arithmetic masks,
+        not branches), and the number of steps depends on the curve, not on the scalar.
+        y coordinate is recovered at the end (Okeya-Sakurai) with a single inversion.
+        Python integers are not constant-time themselves, so this removes bit-dependent control flow,
+        but not every timing difference
+        :param point: point to multiply
+        :param k: scalar, negative values are allowed
+        :return: k * point
+        """
+        if point is None:
+            return None
+        if k < 0:
+            point, k = self.negate(point), -k
+        k = self._reduce_scalar(k)
+        p = self.p
+        x, y = point
+        if y == 0:
+            return point if k % 2 else None
+
+        r0, r1 = (1, 0), (x, 1)
+        bits_amount = max(k.bit_length(), (self.n or p).bit_length() + 1)
+        for bit_no in range(bits_amount - 1, -1, -1):
+            mask = -((k >> bit_no) & 1)
+            difference = mask & (r0[0] ^ r1[0])
+            x0, x1 = r0[0] ^ difference, r1[0] ^ difference
+            difference = mask & (r0[1] ^ r1[1])
+            z0, z1 = r0[1] ^ difference, r1[1] ^ difference
+            r1 = self._ladder_add((x0, z0), (x1, z1), x)
+            r0 = self._ladder_double((x0, z0))
+            difference = mask & (r0[0] ^ r1[0])
+            x0, x1 = r0[0] ^ difference, r1[0] ^ difference
+            difference = mask & (r0[1] ^ r1[1])
+            r0, r1 = (x0, r0[1] ^ difference), (x1, r1[1] ^ difference)
+
+        (x1, z1), (x2, z2) = r0, r1
+        if z1 == 0:
+            return None
+        if z2 == 0:
+            return self.negate(point)
+        # y1 = (2b + (a + x x1)(x + x1) - x2 (x - x1)^2) / (2y), where x1 = X1 / Z1 and x2 = X2 / Z2
+        numerator = (2 * self.b * z1 * z1 * z2 + (self.a * z1 + x * x1) * (x * z1 + x1) * z2
+                     - x2 * (x * z1 - x1) ** 2) % p
+        denominator_inverse = pow(2 * y * z1 * z1 * z2, -1, p)
+        return x1 * 2 * y * z1 * z2 * denominator_inverse % p, numerator * denominator_inverse % p
+
+    def _get_generator_table(self) -> tp.List[tp.List[tp.Tuple[int, int]]]:
+        """
+        Fixed-base table: row j holds d * 2^(wj) * G for d in [1, 2^w - 1].
+        Built on first use and shared by all the users of this (process-wide) object
+        """
+        if self._generator_table is None:
+            with self._generator_table_lock:
+                if self._generator_table is None:
+                    self._generator_table = self._build_fixed_base_table(self.g, self.n.bit_length())
+        return self._generator_table
+
+    def _build_fixed_base_table(self, point: tp.Tuple[int, int], bits_amount: int) -> \
+            tp.List[tp.List[tp.Tuple[int, int]]]:
+        rows_amount = (bits_amount + self.fixed_base_window - 1) // self.fixed_base_window
+        row_length = (1 << self.fixed_base_window) - 1
+        jacobian_points: tp.List[JacobianPoint] = []
+        row_base = self.to_jacobian(point)
+        for _ in range(rows_amount):
+            current = row_base
+            jacobian_points.append(current)
+            for _ in range(row_length - 1):
+                current = self.add(current, row_base)
+                jacobian_points.append(current)
+            for _ in range(self.fixed_base_window):
+                row_base = self.double(row_base)
+        affine_points = self.to_affine_batch(jacobian_points)
+        return [affine_points[row_no * row_length: (row_no + 1) * row_length] for row_no in range(rows_amount)]
+
+    def multiply_generator(self, k: int) -> AffinePoint:
+        """
+        Fixed-base multiplication: k is split into w-bit windows and the precomputed multiples are summed up,
+        no doublings are needed at all
+        """
+        assert self.g is not None and self.n is not None
+        k %= self.n
+        table = self._get_generator_table()
+        window_mask = (1 << self.fixed_base_window) - 1
+        result = INFINITY
+        row_no = 0
+        while k > 0:
+            digit = k & window_mask
+            if digit:
+                result = self.add_mixed(result, table[row_no][digit - 1])
+            k >>= self.fixed_base_window
+            row_no += 1
+        return self.to_affine(result)
+
+    def _get_cached_odd_multiples(self, point: tp.Tuple[int, int]) -> \
+            tp.Tuple[int, tp.Optional[tp.List[tp.Tuple[int, int]]]]:
+        """
+        Odd multiples of the generator are computed once, those of other frequently used points (public keys)
+        are kept in an LRU cache of precomputation_cache_size points, so repeated operations skip the precomputation
+        :return: window width and odd multiples, None if the point has small order
+        """
+        if point == self.g:
+            if self._generator_odd_multiples is None:
+                multiples = self._odd_multiples(point, self.generator_wnaf_width)
+                if None in multiples:
+                    return self.generator_wnaf_width, None
+                self._generator_odd_multiples = multiples
+            return self.generator_wnaf_width, self._generator_odd_multiples
+        width = self.cached_point_wnaf_width
+        with self._odd_multiples_cache_lock:
+            multiples = self._odd_multiples_cache.get(point)
+            if multiples is not None:
+                self._odd_multiples_cache.move_to_end(point)
+                return width, multiples
+        multiples = self._odd_multiples(point, width)
+        if None in multiples:
+            return width, None
+        if self.precomputation_cache_size <= 0:
+            return width, multiples
+        with self._odd_multiples_cache_lock:
+            self._odd_multiples_cache[point] = multiples
+            while len(self._odd_multiples_cache) > self.precomputation_cache_size:
+                self._odd_multiples_cache.popitem(last=False)
+        return width, multiples
+
+    def linear_combination(self, terms: tp.Sequence[tp.Tuple[AffinePoint, int]]) -> AffinePoint:
+        """
+        Calculates k1 * P1 + k2 * P2 + ... with interleaved wNAF (Straus-Shamir method):
+        all the terms share one chain of doublings
+        :param terms: pairs (point, scalar)
+        :return: sum of multiplied points
+        """
+        prepared_terms = []
+        separate_result = INFINITY
+        for point, k in terms:
+            if point is None:
+                continue
+            if k < 0:
+                point, k = self.negate(point), -k
+            k = self._reduce_scalar(k)
+            if k == 0:
+                continue
+            width, multiples = self._get_cached_odd_multiples(point)
+            if multiples is None:
+                separate_result = self.add(separate_result, self.to_jacobian(self._multiply_double_and_add(point, k)))
+                continue
+            prepared_terms.append((self._wnaf(k, width), multiples, [self.negate(multiple) for multiple in multiples]))
+
+        result = INFINITY
+        for digit_no in range(max((len(digits) for digits, _, _ in prepared_terms), default=0) - 1, -1, -1):
+            result = self.double(result)
+            for digits, multiples, negated_multiples in prepared_terms:
+                if digit_no >= len(digits):
+                    continue
+                digit = digits[digit_no]
+                if digit > 0:
+                    result = self.add_mixed(result, multiples[digit >> 1])
+                elif digit < 0:
+                    result = self.add_mixed(result, negated_multiples[(-digit) >> 1])
+        return self.to_affine(self.add(result, separate_result))
+
+    def _invert_all(self, values: tp.Sequence[int]) -> tp.List[int]:
+        """
+        Montgomery's simultaneous inversion of non-zero field elements: one inversion for the whole sequence
+        """
+        p = self.p
+        prefix_products = []
+        accumulator = 1
+        for value in values:
+            prefix_products.append(accumulator)
+            accumulator = accumulator * value % p
+        accumulator_inverse = pow(accumulator, -1, p)
+        result = [0] * len(values)
+        for index in range(len(values) - 1, -1, -1):
+            result[index] = accumulator_inverse * prefix_products[index] % p
+            accumulator_inverse = accumulator_inverse * values[index] % p
+        return result
+
+    def add_to_many(self, points: tp.Sequence[AffinePoint], addend: AffinePoint) -> tp.List[AffinePoint]:
+        """
+        Adds the same point to every point of the sequence in affine coordinates,
+        sharing a single inversion between all the additions
+        :param points: points to add to
+        :param addend: point to add
+        :return: sums in the same order
+        """
+        if addend is None:
+            return list(points)
+        p = self.p
+        x2, y2 = addend
+        denominators = []
+        for point in points:
+            if point is None or (point[0] == x2 and (point[1] != y2 or y2 == 0)):
+                continue
+            denominators.append(2 * y2 % p if point[0] == x2 else (x2 - point[0]) % p)
+        inverses = iter(self._invert_all(denominators))
+        result: tp.List[AffinePoint] = []
+        for point in points:
+            if point is None:
+                result.append(addend)
+                continue
+            x1, y1 = point
+            if x1 == x2 and (y1 != y2 or y2 == 0):
+                result.append(None)
+                continue
+            if x1 == x2:
+                slope = (3 * x1 * x1 + self.a) * next(inverses) % p
+            else:
+                slope = (y2 - y1) * next(inverses) % p
+            x3 = (slope * slope - x1 - x2) % p
+            result.append((x3, (slope * (x1 - x3) - y1) % p))
+        return result
+
+    def add_affine(self, first: AffinePoint, second: AffinePoint) -> AffinePoint:
+        if second is None:
+            return first
+        return self.to_affine(self.add_mixed(self.to_jacobian(first), second))
+
+
+@lru_cache(maxsize=None)
+def get_curve_arithmetic(p: int, a: int, b: int, n: tp.Optional[int] = None,
+                         g: tp.Optional[tp.Tuple[int, int]] = None) -> CurveArithmetic:
+    """
+    Curve arithmetic objects are shared process-wide, so everything they precompute is shared as well
+    """
+    return CurveArithmetic(p, a, b, n, g)
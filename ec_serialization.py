@@ -0,0 +1,132 @@
+import typing as tp
+
+from ec_arithmetic import AffinePoint, CurveArithmetic
+from functions import modular_sqrt
+
+
+CIPHERTEXT_MAGIC = b'MZEC'
+CIPHERTEXT_VERSION = 1
+
+
+def get_field_length(arithmetic: CurveArithmetic) -> int:
+    return (arithmetic.p.bit_length() + 7) // 8
+
+
+def get_point_length(arithmetic: CurveArithmetic, compressed: bool = True) -> int:
+    field_length = get_field_length(arithmetic)
+    return 1 + field_length if compressed else 1 + 2 * field_length
+
+
+def encode_point(arithmetic: CurveArithmetic, point: AffinePoint, compressed: bool = True) -> bytes:
+    """
+    SEC1 point encoding: 0x02/0x03 || x for compressed points (prefix holds parity of y),
+    0x04 || x || y for uncompressed ones and a single 0x00 byte for the point at infinity
+    :param arithmetic: curve the point belongs to
+    :param point: point to encode
+    :param compressed: whether y coordinate should be omitted
+    :return: encoded point
+    """
+    if point is None:
+        return b'\x00'
+    field_length = get_field_length(arithmetic)
+    x, y = point
+    if compressed:
+        return bytes([2 + (y & 1)]) + x.to_bytes(field_length, byteorder='big')
+    return b'\x04' + x.to_bytes(field_length, byteorder='big') + y.to_bytes(field_length, byteorder='big')
+
+
+def decode_point(arithmetic: CurveArithmetic, data: bytes) -> AffinePoint:
+    """
+    Inverse of encode_point. Compressed points are restored with a modular square root,
+    which is a single exponentiation for p = 3 (mod 4)
+    :param arithmetic: curve the point belongs to
+    :param data: encoded point
+    :return: decoded point
+    """
+    field_length = get_field_length(arithmetic)
+    if data == b'\x00':
+        return None
+    prefix = data[0]
+    if prefix in (2, 3) and len(data) == 1 + field_length:
+        x = int.from_bytes(data[1:], byteorder='big')
+        if x >= arithmetic.p:
+            raise ValueError('Point is not on the curve')
+        y = modular_sqrt(x * x * x + arithmetic.a * x + arithmetic.b, arithmetic.p)
+        if y is None:
+            raise ValueError('Point is not on the curve')
+        if (y & 1) != prefix - 2:
+            y = -y % arithmetic.p
+        return x, y
+    if prefix == 4 and len(data) == 1 + 2 * field_length:
+        point = (int.from_bytes(data[1: 1 + field_length], byteorder='big'),
+                 int.from_bytes(data[1 + field_length:], byteorder='big'))
+        if point[0] >= arithmetic.p or point[1] >= arithmetic.p or not arithmetic.is_on_curve(point):
+            raise ValueError('Point is not on the curve')
+        return point
+    raise ValueError('Wrong point encoding')
+
+
+class CiphertextWriter:
+    """
+    Writes EC ElGamal ciphertext to a binary file:
+        magic (4 bytes) || version (1 byte) || compression flag (1 byte) || encoded ephemeral public key ||
+        points, each of them takes exactly get_point_length bytes
+    Point at infinity is written as a zero filled record, so every record has the same length
+    """
+    def __init__(self, output_file: tp.BinaryIO, arithmetic: CurveArithmetic, public_key: AffinePoint,
+                 compressed: bool = True) -> None:
+        self._output_file = output_file
+        self._arithmetic = arithmetic
+        self._compressed = compressed
+        self._point_length = get_point_length(arithmetic, compressed)
+        output_file.write(CIPHERTEXT_MAGIC + bytes([CIPHERTEXT_VERSION, int(compressed)]))
+        output_file.write(self._encode_record(public_key))
+
+    def _encode_record(self, point: AffinePoint) -> bytes:
+        if point is None:
+            return bytes(self._point_length)
+        return encode_point(self._arithmetic, point, self._compressed)
+
+    def write_points(self, points: tp.Iterable[AffinePoint]) -> None:
+        self._output_file.write(b''.join(self._encode_record(point) for point in points))
+
+
+class CiphertextReader:
+    """
+    Reads files written by CiphertextWriter without loading the whole file into memory
+    """
+    def __init__(self, input_file: tp.BinaryIO, arithmetic: CurveArithmetic) -> None:
+        self._input_file = input_file
+        self._arithmetic = arithmetic
+        header = input_file.read(len(CIPHERTEXT_MAGIC) + 2)
+        if len(header) != len(CIPHERTEXT_MAGIC) + 2 or not header.startswith(CIPHERTEXT_MAGIC):
+            raise ValueError('Not an EC ciphertext file')
+        if header[len(CIPHERTEXT_MAGIC)] != CIPHERTEXT_VERSION:
+            raise ValueError('Unsupported EC ciphertext version')
+        self._point_length = get_point_length(arithmetic, bool(header[-1]))
+        self.public_key = self._decode_record(self._read_exactly(self._point_length))
+
+    def _read_exactly(self, length: int) -> bytes:
+        data = self._input_file.read(length)
+        if len(data) != length:
+            raise ValueError('EC ciphertext file is truncated')
+        return data
+
+    def _decode_record(self, record: bytes) -> AffinePoint:
+        if not any(record):
+            return None
+        return decode_point(self._arithmetic, record)
+
+    def read_points(self, chunk_size: int = 4096) -> tp.Generator[tp.List[AffinePoint], None, None]:
+        """
+        :param chunk_size: maximal amount of points in a chunk
+        :return: yields lists of points
+        """
+        while True:
+            data = self._input_file.read(chunk_size * self._point_length)
+            if not data:
+                return
+            if len(data) % self._point_length != 0:
+                raise ValueError('EC ciphertext file is truncated')
+            yield [self._decode_record(data[i: i + self._point_length])
+                   for i in range(0, len(data), self._point_length)]
@@ -1,9 +1,19 @@
 import typing as tp
 
 from collections import defaultdict
+from functools import lru_cache
 from hashlib import sha256
 from bitarray import bitarray
 
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+
+# public key code calls mod_pow, mod_inverse and ModularContext, which use gmpy2 if it is installed
+ARITHMETIC_BACKEND = 'python' if gmpy2 is None else 'gmpy2'
+
 
 def factorize(n: int) -> tp.Dict[int, int]:
     """
@@ -55,6 +65,61 @@ def is_prime(n: int) -> bool:
     return True
 
 
+if gmpy2 is not None:
+    def mod_pow(base: int, exponent: int, modulus: int) -> int:
+        """
+        :return: base ** exponent (mod modulus), negative exponents need base to be invertible
+        """
+        return int(gmpy2.powmod(base, exponent, modulus))
+else:
+    # builtin pow is written in C, exponentiation with Montgomery multiplication in pure Python is slower than it
+    mod_pow = pow
+
+
+def mod_inverse(a: int, modulus: int) -> int:
+    """
+    solves ax = 1 (mod modulus)
+    :raises ValueError: if a and modulus are not relatively prime
+    """
+    if gmpy2 is None:
+        return pow(a, -1, modulus)
+    try:
+        return int(gmpy2.invert(a, modulus))
+    except ZeroDivisionError:
+        raise ValueError('base is not invertible for the given modulus') from None
+
+
+class ModularContext:
+    """
+    Arithmetic modulo a fixed modulus. With gmpy2 the modulus is converted to mpz once
+    and intermediate values stay mpz, all methods except reduce_native return int whatever the backend is
+    """
+    def __init__(self, modulus: int) -> None:
+        self.modulus = modulus
+        self._modulus = modulus if gmpy2 is None else gmpy2.mpz(modulus)
+
+    def reduce_native(self, value: int) -> tp.Any:
+        """
+        :return: value modulo the modulus in the representation of the backend (int or mpz),
+            for intermediate values only
+        """
+        return value % self._modulus
+
+    def reduce(self, value: int) -> int:
+        return int(value % self._modulus)
+
+    def pow(self, base: int, exponent: int) -> int:
+        return mod_pow(base, exponent, self._modulus)
+
+    def inverse(self, a: int) -> int:
+        return mod_inverse(a, self._modulus)
+
+
+@lru_cache(maxsize=64)
+def get_modular_context(modulus: int) -> ModularContext:
+    return ModularContext(modulus)
+
+
 def extended_euclidean(a: int, b: int) -> tp.Tuple[int, int, int]:
     """
     solves ax + by = gcd(a, b)
@@ -62,6 +127,9 @@ def extended_euclidean(a: int, b: int) -> tp.Tuple[int, int, int]:
     :param b: some integer
     :return: Tuple[x, y, gcd(a, b)]
     """
+    if gmpy2 is not None and a >= 0 and b >= 0:
+        residue, x, y = gmpy2.gcdext(a, b)
+        return int(x), int(y), int(residue)
     r1, r2 = a, b
     s1, s2 = 1, 0
     t1, t2 = 0, 1
@@ -85,9 +153,7 @@ def modular_multiplicative_inverse(a: int, b: int) -> int:
     :param b: some integer
     :return: x
     """
-    result, _, residue = extended_euclidean(a, b)
-    assert residue == 1
-    return result % b
+    return mod_inverse(a, b)
 
 
 def get_message_hash(message: str) -> int:
@@ -99,6 +165,108 @@ def get_message_hash(message: str) -> int:
     return int.from_bytes(hashed_message, byteorder='big', signed=False)
 
 
+@lru_cache(maxsize=4096)
+def get_cached_message_hash(message: str) -> int:
+    """
+    Memoized get_message_hash, useful when the same messages are verified over and over
+    :param message: some string
+    :return: hash of given string
+    """
+    return get_message_hash(message)
+
+
+def jacobi_symbol(a: int, n: int) -> int:
+    """
+    Calculates Jacobi symbol (a/n) without exponentiation, for prime n it is the Legendre symbol
+    :param a: some integer
+    :param n: odd positive integer
+    :return: 1, -1 or 0
+    """
+    assert n > 0 and n % 2 == 1
+    a %= n
+    result = 1
+    while a != 0:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 in (3, 5):
+                result = -result
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            result = -result
+        a %= n
+    return result if n == 1 else 0
+
+
+def modular_sqrt(a: int, p: int) -> tp.Optional[int]:
+    """
+    Solves x^2 = a (mod p) with Tonelli-Shanks algorithm, for p = 3 (mod 4) it is a single exponentiation
+    :param a: some integer
+    :param p: odd prime number
+    :return: one of the roots or None if a is not a quadratic residue
+    """
+    a %= p
+    if a == 0:
+        return 0
+    if p % 4 == 3:
+        root = mod_pow(a, (p + 1) // 4, p)
+        return root if root * root % p == a else None
+    if mod_pow(a, (p - 1) // 2, p) != 1:
+        return None
+    q, s = p - 1, 0
+    while q % 2 == 0:
+        q //= 2
+        s += 1
+    z = 2
+    while mod_pow(z, (p - 1) // 2, p) != p - 1:
+        z += 1
+    m, c, t, root = s, mod_pow(z, q, p), mod_pow(a, q, p), mod_pow(a, (q + 1) // 2, p)
+    while t != 1:
+        i, t_power = 0, t
+        while t_power != 1:
+            t_power = t_power * t_power % p
+            i += 1
+        b = mod_pow(c, 1 << (m - i - 1), p)
+        m, c = i, b * b % p
+        t, root = t * c % p, root * b % p
+    return root
+
+
+def multi_pow(bases_and_exponents: tp.Sequence[tp.Tuple[int, int]], modulus: int) -> int:
+    """
+    Calculates product of base ** exponent (mod modulus) sharing one squaring chain between all the bases.
+    For a few bases products of all base subsets are precomputed (Shamir's trick),
+    so every bit costs one squaring and at most one multiplication
+    :param bases_and_exponents: pairs (base, non-negative exponent)
+    :param modulus: some integer
+    :return: product of powers
+    """
+    context = get_modular_context(modulus)
+    bases = [context.reduce_native(base) for base, _ in bases_and_exponents]
+    exponents = [exponent for _, exponent in bases_and_exponents]
+    assert all(exponent >= 0 for exponent in exponents)
+    bits_amount = max((exponent.bit_length() for exponent in exponents), default=0)
+    result = context.reduce_native(1)
+    if len(bases) <= 4:
+        subset_products = [1] * (1 << len(bases))
+        for mask in range(1, len(subset_products)):
+            lowest_bit = mask & -mask
+            subset_products[mask] = subset_products[mask ^ lowest_bit] * bases[lowest_bit.bit_length() - 1] % modulus
+        for bit_no in range(bits_amount - 1, -1, -1):
+            result = result * result % modulus
+            mask = 0
+            for index, exponent in enumerate(exponents):
+                mask |= ((exponent >> bit_no) & 1) << index
+            if mask:
+                result = result * subset_products[mask] % modulus
+        return int(result)
+    for bit_no in range(bits_amount - 1, -1, -1):
+        result = result * result % modulus
+        for base, exponent in zip(bases, exponents):
+            if (exponent >> bit_no) & 1:
+                result = result * base % modulus
+    return int(result)
+
+
 def left_cycle_shift(array: bitarray, bits_amount: int) -> bitarray:
     """
     Performs cycle shift of a byte array
@@ -107,3 +275,21 @@ def left_cycle_shift(array: bitarray, bits_amount: int) -> bitarray:
     :return: array after shift
     """
     return array[bits_amount:] + array[:bits_amount]
+
+
+def read_bits(input_file: tp.BinaryIO) -> bitarray:
+    """
+    :param input_file: file opened in binary mode
+    :return: whole content of the file
+    """
+    result = bitarray()
+    result.fromfile(input_file)
+    return result
+
+
+def write_bits(array: bitarray, output_file: tp.BinaryIO) -> None:
+    """
+    :param array: bits to write, padded with zeros up to whole bytes
+    :param output_file: file opened in binary mode
+    """
+    array.tofile(output_file)
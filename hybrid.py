@@ -0,0 +1,270 @@
+import typing as tp
+import hmac
+import io
+import struct
+import time
+from hashlib import sha256
+from secrets import randbelow
+
+from ec_serialization import decode_point, encode_point
+from functions import mod_pow
+from streaming import DEFAULT_CHUNK_SIZE, ReadAhead, WriteBehind, get_chunk_size, load_cipher, xor_with_keystream
+
+
+ENVELOPE_MAGIC = b'MZHE'
+ENVELOPE_VERSION = 2
+# magic, version, kem, cipher, chunk size, length of the encapsulated key
+HEADER_FORMAT = struct.Struct('>4sBBBIH')
+# decryption buffers a whole chunk before its HMAC is checked, so larger chunks are refused
+MAX_CHUNK_SIZE = 1 << 24
+# whether the chunk is the last one, length of the chunk
+CHUNK_FORMAT = struct.Struct('>BI')
+TAG_LENGTH = sha256().digest_size
+CIPHERS = ('gost', 'stb')
+SESSION_KEY_LENGTH = 32
+
+
+class RsaKem:
+    """
+    RSA-KEM: random r < n is encrypted as is, the session keys are derived from r
+    """
+    name = 'rsa'
+
+    def __init__(self, rsa: tp.Any) -> None:
+        """
+        :param rsa: lab3.RSA, decapsulation needs its private key
+        """
+        self._public_key = rsa.public_key
+        self._private_key = rsa.private_key
+        self._length = (self._public_key[1].bit_length() + 7) // 8
+
+    def encapsulate(self) -> tp.Tuple[bytes, bytes]:
+        """
+        :return: shared secret and its encapsulation
+        """
+        e, n = self._public_key
+        secret = randbelow(n - 2) + 2
+        return secret.to_bytes(self._length, 'big'), mod_pow(secret, e, n).to_bytes(self._length, 'big')
+
+    def decapsulate(self, encapsulated: bytes) -> bytes:
+        d, n = self._private_key
+        value = int.from_bytes(encapsulated, 'big')
+        if len(encapsulated) != self._length or value >= n:
+            raise ValueError('Wrong encapsulated key')
+        return mod_pow(value, d, n).to_bytes(self._length, 'big')
+
+
+class ElGamalKem:
+    """
+    Ephemeral Diffie-Hellman with the ElGamal public key y: the encapsulation is g^k, the secret is y^k
+    """
+    name = 'elgamal'
+
+    def __init__(self, elgamal: tp.Any) -> None:
+        """
+        :param elgamal: lab4.ElGamal
+        """
+        self._elgamal = elgamal
+        self._length = (elgamal.p.bit_length() + 7) // 8
+
+    def encapsulate(self) -> tp.Tuple[bytes, bytes]:
+        p = self._elgamal.p
+        k = randbelow(p - 2) + 1
+        return mod_pow(self._elgamal.y, k, p).to_bytes(self._length, 'big'), \
+            mod_pow(self._elgamal.g, k, p).to_bytes(self._length, 'big')
+
+    def decapsulate(self, encapsulated: bytes) -> bytes:
+        p = self._elgamal.p
+        value = int.from_bytes(encapsulated, 'big')
+        if len(encapsulated) != self._length or not 1 < value < p:
+            raise ValueError('Wrong encapsulated key')
+        return mod_pow(value, self._elgamal.x, p).to_bytes(self._length, 'big')
+
+
+class EcKem:
+    """
+    ECIES style encapsulation with the curve and engine of lab7.Encoder: the encapsulation is the compressed
+    point kG, the secret is x coordinate of k * public_key
+    """
+    name = 'ec'
+
+    def __init__(self, encoder: tp.Any, public_key: tp.Any, private_key: tp.Optional[int] = None) -> None:
+        """
+        :param encoder: lab7.Encoder
+        :param public_key: public key point of the recipient
+        :param private_key: private key of the recipient, needed only for decapsulation
+        """
+        self._encoder = encoder
+        self._arithmetic = encoder.arithmetic
+        self._public_key = public_key
+        self._private_key = private_key
+        self._length = (self._arithmetic.p.bit_length() + 7) // 8
+
+    def _to_secret(self, point: tp.Any) -> bytes:
+        point = self._encoder.from_point(point)
+        if point is None:
+            raise ValueError('Shared point is the point at infinity')
+        return point[0].to_bytes(self._length, 'big')
+
+    def encapsulate(self) -> tp.Tuple[bytes, bytes]:
+        k = randbelow(self._arithmetic.n - 1) + 1
+        ephemeral_key = self._encoder.multiply_generator(k)
+        return self._to_secret(self._encoder.multiply(self._public_key, k)), \
+            encode_point(self._arithmetic, self._encoder.from_point(ephemeral_key))
+
+    def decapsulate(self, encapsulated: bytes) -> bytes:
+        if self._private_key is None:
+            raise ValueError('Private key is needed for decapsulation')
+        ephemeral_key = self._encoder.to_point(decode_point(self._arithmetic, encapsulated))
+        return self._to_secret(self._encoder.multiply(ephemeral_key, self._private_key))
+
+
+Kem = tp.Union[RsaKem, ElGamalKem, EcKem]
+KEMS = (RsaKem.name, ElGamalKem.name, EcKem.name)
+
+
+def _derive_keys(secret: bytes, encapsulated: bytes) -> tp.Tuple[bytes, bytes]:
+    """
+    HKDF with SHA-256, the encapsulated key is the salt
+    :return: cipher key and MAC key
+    """
+    pseudorandom_key = hmac.new(encapsulated, secret, sha256).digest()
+    return hmac.new(pseudorandom_key, b'cipher\x01', sha256).digest()[:SESSION_KEY_LENGTH], \
+        hmac.new(pseudorandom_key, b'mac\x01', sha256).digest()
+
+
+def _get_chunk_tag(mac_key: bytes, chunk_no: int, frame: bytes, chunk: tp.Union[bytes, bytearray]) -> bytes:
+    return hmac.new(mac_key, chunk_no.to_bytes(8, 'big') + frame + chunk, sha256).digest()
+
+
+def encrypt_stream(kem: Kem, input_file: tp.BinaryIO, output_file: tp.BinaryIO, algorithm: str = 'gost',
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """
+    Encrypts the input with a fresh session key in CTR mode, the session key is encapsulated with the kem.
+    Envelope: header, encapsulated key, nonce and their HMAC, then chunks, each of them is
+    (is last, length), cipher text and HMAC of the chunk number, frame and the cipher text (encrypt-then-MAC)
+    :param kem: RsaKem, ElGamalKem or EcKem of the recipient
+    :param input_file: binary file to read plain text from
+    :param output_file: binary file to write the envelope to
+    :param algorithm: one of CIPHERS
+    :param chunk_size: amount of bytes in a chunk, rounded down to whole blocks, at most MAX_CHUNK_SIZE
+    """
+    if algorithm not in CIPHERS:
+        raise ValueError(f'algorithm should be one of {CIPHERS}')
+    if chunk_size > MAX_CHUNK_SIZE:
+        raise ValueError(f'chunk_size should be at most {MAX_CHUNK_SIZE}')
+    secret, encapsulated = kem.encapsulate()
+    cipher_key, mac_key = _derive_keys(secret, encapsulated)
+    cipher = load_cipher(algorithm, cipher_key)
+    block_length = cipher.block_length
+    chunk_size = get_chunk_size(cipher, chunk_size)
+    nonce = randbelow(1 << (block_length * 4)).to_bytes(block_length // 2, 'big')
+
+    header = HEADER_FORMAT.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION, KEMS.index(kem.name), CIPHERS.index(algorithm),
+                                chunk_size, len(encapsulated)) + encapsulated + nonce
+    writer = WriteBehind(output_file)
+    try:
+        writer.write(header + hmac.new(mac_key, header, sha256).digest())
+        chunk_no = -1
+        for chunk_no, (chunk, is_last) in enumerate(ReadAhead(input_file, chunk_size)):
+            encrypted_chunk = xor_with_keystream(cipher, nonce, chunk_no * chunk_size // block_length, chunk)
+            frame = CHUNK_FORMAT.pack(is_last, len(encrypted_chunk))
+            writer.write(frame + encrypted_chunk + _get_chunk_tag(mac_key, chunk_no, frame, encrypted_chunk))
+        if chunk_no == -1:
+            frame = CHUNK_FORMAT.pack(True, 0)
+            writer.write(frame + _get_chunk_tag(mac_key, 0, frame, b''))
+    finally:
+        writer.close()
+
+
+def _read_exactly(input_file: tp.BinaryIO, length: int) -> bytes:
+    data = input_file.read(length)
+    if len(data) != length:
+        raise ValueError('Envelope is truncated')
+    return data
+
+
+def decrypt_stream(kem: Kem, input_file: tp.BinaryIO, output_file: tp.BinaryIO) -> None:
+    """
+    Inverse of encrypt_stream. Every chunk is authenticated before its plain text is written, so on
+    a ValueError the output holds only a verified prefix of the message
+    :param kem: RsaKem, ElGamalKem or EcKem with the private key of the recipient
+    :raises ValueError: if the envelope is malformed, truncated or tampered with
+    """
+    header = _read_exactly(input_file, HEADER_FORMAT.size)
+    magic, version, kem_no, cipher_no, chunk_size, encapsulated_length = HEADER_FORMAT.unpack(header)
+    if magic != ENVELOPE_MAGIC or version != ENVELOPE_VERSION:
+        raise ValueError('Input is not a hybrid envelope')
+    if kem_no >= len(KEMS) or KEMS[kem_no] != kem.name or cipher_no >= len(CIPHERS):
+        raise ValueError('Envelope is made for another key encapsulation or cipher')
+    if chunk_size > MAX_CHUNK_SIZE:
+        raise ValueError('Envelope is malformed')
+    encapsulated = _read_exactly(input_file, encapsulated_length)
+    cipher_key, mac_key = _derive_keys(kem.decapsulate(encapsulated), encapsulated)
+    cipher = load_cipher(CIPHERS[cipher_no], cipher_key)
+    block_length = cipher.block_length
+    nonce = _read_exactly(input_file, block_length // 2)
+    header += encapsulated + nonce
+    if not hmac.compare_digest(hmac.new(mac_key, header, sha256).digest(), _read_exactly(input_file, TAG_LENGTH)):
+        raise ValueError('Envelope authentication failed')
+
+    writer = WriteBehind(output_file)
+    try:
+        chunk_no = first_block_no = 0
+        is_last = False
+        while not is_last:
+            frame = _read_exactly(input_file, CHUNK_FORMAT.size)
+            is_last, length = CHUNK_FORMAT.unpack(frame)
+            if length > chunk_size or not is_last and length % block_length != 0:
+                raise ValueError('Envelope is malformed')
+            encrypted_chunk = _read_exactly(input_file, length)
+            tag = _read_exactly(input_file, TAG_LENGTH)
+            if not hmac.compare_digest(_get_chunk_tag(mac_key, chunk_no, frame, encrypted_chunk), tag):
+                raise ValueError('Envelope authentication failed')
+            writer.write(xor_with_keystream(cipher, nonce, first_block_no, encrypted_chunk))
+            chunk_no += 1
+            first_block_no += length // block_length
+        if input_file.read(1):
+            raise ValueError('Envelope is malformed')
+    finally:
+        writer.close()
+
+
+def encrypt(kem: Kem, message: bytes, algorithm: str = 'gost') -> bytes:
+    output = io.BytesIO()
+    encrypt_stream(kem, io.BytesIO(message), output, algorithm)
+    return output.getvalue()
+
+
+def decrypt(kem: Kem, envelope: bytes) -> bytes:
+    output = io.BytesIO()
+    decrypt_stream(kem, io.BytesIO(envelope), output)
+    return output.getvalue()
+
+
+def main() -> None:
+    from lab3 import RSA
+    from lab4 import ElGamal
+    from lab7 import Encoder
+    from tinyec import registry
+
+    with open('input_files/input_lab3.txt', 'r') as f:
+        message = f.read()
+    rsa = RSA(*RSA.generate_key_pair(68963, 66047))
+    encoder = Encoder(registry.get_curve('secp256r1'))
+    private_key, public_key = encoder.generate_key_pair()
+    kems = (RsaKem(rsa), ElGamalKem(ElGamal(4294969633)), EcKem(encoder, public_key, private_key))
+
+    start = time.perf_counter()
+    rsa.decrypt(rsa.encrypt(message))
+    print(f'rsa without key encapsulation: {time.perf_counter() - start:.3f} s')
+    for kem in kems:
+        for algorithm in CIPHERS:
+            start = time.perf_counter()
+            envelope = encrypt(kem, message.encode('UTF-8'), algorithm)
+            assert decrypt(kem, envelope).decode('UTF-8') == message
+            print(f'{kem.name} + {algorithm}: {time.perf_counter() - start:.3f} s, {len(envelope)} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+import typing as tp
+import builtins
+import contextlib
+import functools
+import importlib
+import json
+import threading
+import time
+
+
+Labels = tp.Tuple[tp.Tuple[str, str], ...]
+
+# rounds of a single block transformation
+ROUNDS_PER_BLOCK = {'Des': 16, 'Gost2814789': 56, 'Stb': 8, 'MD5': 64}
+
+
+class MetricsRegistry:
+    """
+    Thread safe storage of counters and timers. Timers are exported as Prometheus summaries
+    (sum and count of observed durations)
+    """
+    def __init__(self, prefix: str = 'mzi_') -> None:
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: tp.Dict[str, tp.Dict[Labels, int]] = {}
+        self._timers: tp.Dict[str, tp.Dict[Labels, tp.List[float]]] = {}
+
+    @staticmethod
+    def _to_labels(labels: tp.Dict[str, tp.Any]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def increment(self, name: str, value: int = 1, **labels: tp.Any) -> None:
+        key = self._to_labels(labels)
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: tp.Any) -> None:
+        key = self._to_labels(labels)
+        with self._lock:
+            timer = self._timers.setdefault(name, {}).setdefault(key, [0., 0])
+            timer[0] += seconds
+            timer[1] += 1
+
+    @contextlib.contextmanager
+    def time(self, name: str, **labels: tp.Any) -> tp.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get_counter(self, name: str, **labels: tp.Any) -> int:
+        """
+        :return: sum of all counters with this name, which have given labels
+        """
+        with self._lock:
+            return sum(value for key, value in self._counters.get(name, {}).items()
+                       if set(self._to_labels(labels)) <= set(key))
+
+    def get_timer(self, name: str, **labels: tp.Any) -> tp.Tuple[float, int]:
+        """
+        :return: total seconds and amount of observations of all timers with this name, which have given labels
+        """
+        with self._lock:
+            observations = [value for key, value in self._timers.get(name, {}).items()
+                            if set(self._to_labels(labels)) <= set(key)]
+        return sum(seconds for seconds, _ in observations), sum(count for _, count in observations)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def to_dict(self) -> tp.Dict[str, tp.List[tp.Dict[str, tp.Any]]]:
+        with self._lock:
+            result: tp.Dict[str, tp.List[tp.Dict[str, tp.Any]]] = {}
+            for name, values in self._counters.items():
+                result[self.prefix + name] = [{'labels': dict(key), 'value': value} for key, value in values.items()]
+            for name, values in self._timers.items():
+                result[self.prefix + name] = [{'labels': dict(key), 'sum': seconds, 'count': count}
+                                              for key, (seconds, count) in values.items()]
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    @staticmethod
+    def _format_labels(labels: Labels) -> str:
+        if not labels:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+    def to_prometheus(self) -> str:
+        """
+        :return: metrics in Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, values in sorted(self._counters.items()):
+                lines.append(f'# TYPE {self.prefix}{name} counter')
+                lines.extend(f'{self.prefix}{name}{self._format_labels(key)} {value}'
+                             for key, value in sorted(values.items()))
+            for name, values in sorted(self._timers.items()):
+                lines.append(f'# TYPE {self.prefix}{name} summary')
+                for key, (seconds, count) in sorted(values.items()):
+                    lines.append(f'{self.prefix}{name}_sum{self._format_labels(key)} {seconds!r}')
+                    lines.append(f'{self.prefix}{name}_count{self._format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+_active_registry: tp.Optional[MetricsRegistry] = None
+_missing = object()
+# (namespace, attribute, original value) of every installed hook
+_patches: tp.List[tp.Tuple[tp.Any, str, tp.Any]] = []
+_patches_lock = threading.Lock()
+_local = threading.local()
+
+
+def _time_phase(phase: str, algorithm: tp.Optional[str] = None) -> tp.Callable[[tp.Callable], tp.Callable]:
+    """
+    Methods are labeled with the class of the instance, static methods and functions with the given algorithm
+    """
+    def factory(original: tp.Callable) -> tp.Callable:
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            registry = _active_registry
+            if registry is None:
+                return original(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                registry.observe('phase_seconds', time.perf_counter() - start, phase=phase,
+                                 algorithm=algorithm or type(args[0]).__name__)
+        return wrapper
+    return factory
+
+
+def _count_blocks(operation: str, is_buffer: bool = False) -> tp.Callable[[tp.Callable], tp.Callable]:
+    """
+    encrypt/decrypt call encrypt_into/decrypt_into, only the outer call is counted
+    :param is_buffer: whether the message is a bytes-like object instead of a bitarray
+    """
+    def factory(original: tp.Callable) -> tp.Callable:
+        @functools.wraps(original)
+        def wrapper(self, message, *args, **kwargs):
+            registry = _active_registry
+            active_calls = _local.__dict__.setdefault('active_calls', set())
+            if registry is None or (id(self), operation) in active_calls:
+                return original(self, message, *args, **kwargs)
+            algorithm = type(self).__name__
+            active_calls.add((id(self), operation))
+            start = time.perf_counter()
+            try:
+                return original(self, message, *args, **kwargs)
+            finally:
+                active_calls.discard((id(self), operation))
+                registry.observe('phase_seconds', time.perf_counter() - start, phase='core', algorithm=algorithm)
+                length = memoryview(message).nbytes * 8 if is_buffer else len(message)
+                registry.increment('blocks_total', -(-length // self._message_block_length),
+                                   algorithm=algorithm, operation=operation)
+        return wrapper
+    return factory
+
+
+def _count_rounds(original: tp.Callable) -> tp.Callable:
+    @functools.wraps(original)
+    def wrapper(self, *args, **kwargs):
+        registry = _active_registry
+        if registry is not None:
+            algorithm = type(self).__name__
+            registry.increment('rounds_total', ROUNDS_PER_BLOCK.get(algorithm, 1), algorithm=algorithm)
+        return original(self, *args, **kwargs)
+    return wrapper
+
+
+def _count_bitsliced_rounds(original: tp.Callable) -> tp.Callable:
+    @functools.wraps(original)
+    def wrapper(self, source, destination, stages, *args, **kwargs):
+        is_processed = original(self, source, destination, stages, *args, **kwargs)
+        registry = _active_registry
+        if registry is not None and is_processed:
+            registry.increment('rounds_total', len(source) // self.block_length * len(stages)
+                               * ROUNDS_PER_BLOCK['Des'], algorithm='Des')
+        return is_processed
+    return wrapper
+
+
+def _count_hash_blocks(original: tp.Callable) -> tp.Callable:
+    @functools.wraps(original)
+    def wrapper(self, message, *args, **kwargs):
+        registry = _active_registry
+        if registry is None:
+            return original(self, message, *args, **kwargs)
+        blocks = (len(message) + 64) // 512 + 1
+        registry.increment('blocks_total', blocks, algorithm='MD5', operation='hash')
+        registry.increment('rounds_total', blocks * ROUNDS_PER_BLOCK['MD5'], algorithm='MD5')
+        with registry.time('phase_seconds', phase='core', algorithm='MD5'):
+            return original(self, message, *args, **kwargs)
+    return wrapper
+
+
+def _count_point_operation(operation: str) -> tp.Callable[[tp.Callable], tp.Callable]:
+    def factory(original: tp.Callable) -> tp.Callable:
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            registry = _active_registry
+            if registry is not None:
+                registry.increment('point_operations_total', operation=operation)
+            return original(*args, **kwargs)
+        return wrapper
+    return factory
+
+
+def _count_pow(module: str) -> tp.Callable[[tp.Callable], tp.Callable]:
+    """
+    Module level pow shadows the builtin one for all the code of the module,
+    mod_pow imported from functions is wrapped in the namespace of every module using it.
+    pow(a, -1, m) is an inversion, not an exponentiation, so negative exponents are counted separately
+    """
+    def factory(original: tp.Optional[tp.Callable]) -> tp.Callable:
+        function = builtins.pow if original is None else original
+
+        def wrapper(base, exp, mod=None):
+            registry = _active_registry
+            if mod is not None and registry is not None:
+                registry.increment('modular_exponentiations_total' if exp >= 0 else 'modular_inversions_total',
+                                   module=module)
+            return function(base, exp, mod)
+        return wrapper
+    return factory
+
+
+# (module, class or None for module level names, attribute, wrapper factory)
+_HOOKS: tp.Tuple[tp.Tuple[str, tp.Optional[str], str, tp.Callable[[tp.Callable], tp.Callable]], ...] = (
+    ('block_cipher', 'BlockCipher', 'encrypt', _count_blocks('encrypt')),
+    ('block_cipher', 'BlockCipher', 'decrypt', _count_blocks('decrypt')),
+    ('block_cipher', 'BlockCipher', '_pad_block', _time_phase('padding')),
+    ('block_cipher', None, 'read_bits', _time_phase('io', 'BlockCipher')),
+    ('block_cipher', None, 'write_bits', _time_phase('io', 'BlockCipher')),
+    ('block_cipher', 'BlockCipher', 'encrypt_into', _count_blocks('encrypt', is_buffer=True)),
+    ('block_cipher', 'BlockCipher', 'decrypt_into', _count_blocks('decrypt', is_buffer=True)),
+    ('lab1_des', 'Des', '_make_keys', _time_phase('key_schedule')),
+    # bitsliced engine expands every key into planes once per call instead of calling _make_keys per block
+    ('bitsliced_des', None, 'key_to_planes', _time_phase('key_schedule', 'Des')),
+    ('lab1_des', 'Des', '_encrypt_block', _count_rounds),
+    ('lab1_des', 'Des', '_decrypt_block', _count_rounds),
+    ('lab1_des', 'Des', 'process_stages_into', _count_bitsliced_rounds),
+    ('lab1_gost', 'Gost2814789', '_encrypt_block', _count_rounds),
+    ('lab1_gost', 'Gost2814789', '_decrypt_block', _count_rounds),
+    ('lab2', 'Stb', '_encrypt_block', _count_rounds),
+    ('lab2', 'Stb', '_decrypt_block', _count_rounds),
+    ('lab5', 'MD5', 'hash_message', _count_hash_blocks),
+    ('lab5', 'MD5', '_pad_message', _time_phase('padding', 'MD5')),
+    ('lab5', None, 'read_bits', _time_phase('io', 'MD5')),
+    ('lab5', None, 'write_bits', _time_phase('io', 'MD5')),
+    ('ec_arithmetic', 'CurveArithmetic', 'double', _count_point_operation('double')),
+    ('ec_arithmetic', 'CurveArithmetic', 'add', _count_point_operation('add')),
+    ('ec_arithmetic', 'CurveArithmetic', 'add_mixed', _count_point_operation('add_mixed')),
+    ('ec_arithmetic', 'CurveArithmetic', 'add_affine', _count_point_operation('add_affine')),
+    ('ec_arithmetic', 'CurveArithmetic', '_ladder_add', _count_point_operation('ladder_add')),
+    ('ec_arithmetic', 'CurveArithmetic', '_ladder_double', _count_point_operation('ladder_double')),
+    ('ec_arithmetic', 'CurveArithmetic', 'multiply', _time_phase('scalar_multiplication')),
+    ('ec_arithmetic', 'CurveArithmetic', 'multiply_generator', _time_phase('scalar_multiplication')),
+    ('ec_arithmetic', 'CurveArithmetic', 'ladder_multiply', _time_phase('scalar_multiplication')),
+    ('ec_arithmetic', 'CurveArithmetic', 'linear_combination', _time_phase('scalar_multiplication')),
+    ('tinyec.ec', 'Point', '__add__', _count_point_operation('tinyec_add')),
+    ('tinyec.ec', 'Point', '__mul__', _time_phase('scalar_multiplication')),
+) + tuple((module, None, 'pow', _count_pow(module))
+          for module in ('functions', 'lab7', 'lab7_old', 'ec_arithmetic')) + tuple(
+    (module, None, 'mod_pow', _count_pow(module)) for module in ('functions', 'lab3', 'lab4', 'lab6', 'hybrid'))
+
+
+def _install_hooks() -> None:
+    # everything is imported before patching, otherwise modules imported later would copy patched functions
+    modules = {}
+    for module_name in dict.fromkeys(module_name for module_name, _, _, _ in _HOOKS):
+        try:
+            modules[module_name] = importlib.import_module(module_name)
+        except ImportError:
+            continue
+    for module_name, class_name, attribute, factory in _HOOKS:
+        if module_name not in modules:
+            continue
+        namespace = modules[module_name]
+        if class_name is not None:
+            namespace = getattr(namespace, class_name)
+        original = vars(namespace).get(attribute, _missing)
+        if isinstance(original, staticmethod):
+            replacement = staticmethod(factory(original.__func__))
+        else:
+            replacement = factory(getattr(namespace, attribute, None))
+        _patches.append((namespace, attribute, original))
+        setattr(namespace, attribute, replacement)
+
+
+def _remove_hooks() -> None:
+    while _patches:
+        namespace, attribute, original = _patches.pop()
+        if original is _missing:
+            delattr(namespace, attribute)
+        else:
+            setattr(namespace, attribute, original)
+
+
+def is_enabled() -> bool:
+    return _active_registry is not None
+
+
+def enable(registry: MetricsRegistry = REGISTRY) -> MetricsRegistry:
+    """
+    Installs hooks into hot paths of ciphers, hashes and EC arithmetic. Nothing is patched
+    until this is called, so disabled instrumentation costs nothing.
+    Timed phases nest: core time of a cipher includes its padding and key schedule
+    :param registry: registry to collect metrics into
+    :return: the registry
+    """
+    global _active_registry
+    with _patches_lock:
+        if not _patches:
+            _install_hooks()
+        _active_registry = registry
+    return registry
+
+
+def disable() -> None:
+    """
+    Restores original methods, collected metrics stay in the registry
+    """
+    global _active_registry
+    with _patches_lock:
+        _active_registry = None
+        _remove_hooks()
+
+
+@contextlib.contextmanager
+def profile(registry: tp.Optional[MetricsRegistry] = None) -> tp.Iterator[MetricsRegistry]:
+    """
+    Collects metrics of the code inside the block:
+        with profile() as metrics:
+            cipher.encrypt(message)
+        print(metrics.to_prometheus())
+    :param registry: registry to collect metrics into, a new one by default
+    :return: yields the registry
+    """
+    previous_registry = _active_registry
+    registry = enable(MetricsRegistry() if registry is None else registry)
+    try:
+        yield registry
+    finally:
+        if previous_registry is None:
+            disable()
+        else:
+            enable(previous_registry)
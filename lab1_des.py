@@ -1,6 +1,6 @@
 import typing as tp
-import numpy as np
 import dataclasses
+import random
 
 from bitarray import bitarray
 from bitarray.util import ba2int, int2ba
@@ -20,9 +20,15 @@ class DesCipherConstParameters:
 
 
 class Des(BlockCipher, message_block_length=64):
+    # messages of at least this many blocks are processed by bitsliced_des, None turns it off
+    bitsliced_min_blocks: tp.Optional[int] = 64
+
     def __init__(self, const_parameters: DesCipherConstParameters, key: bitarray) -> None:
         super().__init__()
 
+        self._const_parameters = const_parameters
+        self._bitsliced_engine = None
+
         self._ip_permutation = const_parameters.ip_permutation
         self._inverse_ip_permutation = self._inverse_permutation(const_parameters.ip_permutation)
 
@@ -37,19 +43,19 @@ class Des(BlockCipher, message_block_length=64):
 
     @staticmethod
     def generate_parameters() -> DesCipherConstParameters:
-        ip_permutation = np.random.permutation(64).tolist()
-        e_permutation = np.random.randint(0, 32, 48).tolist()
+        ip_permutation = random.sample(range(64), 64)
+        e_permutation = [random.randrange(32) for _ in range(48)]
         s_boxes = []
 
         for _ in range(8):
             table = []
             for _ in range(4):
-                table.append(np.random.permutation(16).tolist())
+                table.append(random.sample(range(16), 16))
             s_boxes.append(table)
 
-        p_permutation = np.random.permutation(32).tolist()
-        pc_1_permutation = np.random.permutation(56).tolist()
-        pc_2_permutation = np.random.permutation(48).tolist()
+        p_permutation = random.sample(range(32), 32)
+        pc_1_permutation = random.sample(range(56), 56)
+        pc_2_permutation = random.sample(range(48), 48)
 
         return DesCipherConstParameters(ip_permutation, e_permutation, s_boxes, p_permutation, pc_1_permutation, ## noqa
                                         pc_2_permutation) ## noqa
@@ -89,6 +95,28 @@ class Des(BlockCipher, message_block_length=64):
     def change_key(self, key: bitarray) -> None:
         self._key = key
 
+    def process_stages_into(self, source: memoryview, destination: memoryview,
+                            stages: tp.Sequence[tp.Tuple[bool, bitarray]]) -> bool:
+        """
+        Runs whole blocks through several passes of Des with bitsliced_des if there are at least
+        bitsliced_min_blocks of them, ciphers built of Des (DoubleDes, TripleDes) use it for bulk processing
+        :param source: whole blocks
+        :param destination: buffer of the same length
+        :param stages: (whether stage encrypts, key) for every pass of Des
+        :return: whether the blocks were processed, if not the caller should process them block by block
+        """
+        if self.bitsliced_min_blocks is None or len(source) < self.bitsliced_min_blocks * self.block_length:
+            return False
+        if self._bitsliced_engine is None:
+            from bitsliced_des import BitslicedDes
+            self._bitsliced_engine = BitslicedDes(self._const_parameters)
+        self._bitsliced_engine.process_into(source, destination, stages)
+        return True
+
+    def _process_into(self, source: memoryview, destination: memoryview, is_encryption: bool) -> None:
+        if not self.process_stages_into(source, destination, [(is_encryption, self._key)]):
+            super()._process_into(source, destination, is_encryption)
+
     def _feistel_function(self, block_part: bitarray, key: bitarray) -> bitarray:
         extended_block = self._make_extension(block_part, self._e_permutation)
         block_key_xor = key ^ extended_block
@@ -26,6 +26,14 @@ class DoubleDes(BlockCipher, message_block_length=64):
         secondly_decrypted_message_block = self._des_cipher.decrypt(firstly_decrypted_message_block)
         return secondly_decrypted_message_block
 
+    def _process_into(self, source: memoryview, destination: memoryview, is_encryption: bool) -> None:
+        if is_encryption:
+            stages = [(False, self._second_key), (False, self._first_key)]
+        else:
+            stages = [(True, self._first_key), (True, self._second_key)]
+        if not self._des_cipher.process_stages_into(source, destination, stages):
+            super()._process_into(source, destination, is_encryption)
+
 
 def main() -> None:
     keys = bitarray(56), bitarray(56)
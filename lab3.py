@@ -1,7 +1,7 @@
 import typing as tp
 
-from numpy.random import randint
-from functions import is_prime, are_relatively_prime
+from secrets import randbelow
+from functions import is_prime, are_relatively_prime, mod_inverse, mod_pow
 
 
 class RSA:
@@ -9,16 +9,30 @@ class RSA:
         self._public_key = public_key
         self._private_key = private_key
 
+    @property
+    def public_key(self) -> tp.Tuple[int, int]:
+        """
+        :return: (e, n)
+        """
+        return self._public_key
+
+    @property
+    def private_key(self) -> tp.Tuple[int, int]:
+        """
+        :return: (d, n)
+        """
+        return self._private_key
+
     @staticmethod
     def generate_key_pair(p: int, q: int) -> tp.Tuple[tp.Tuple[int, int], tp.Tuple[int, int]]:
         assert is_prime(p)
         assert is_prime(q)
         n = p * q
         phi = (p - 1) * (q - 1)
-        d = randint(1, n)
+        d = randbelow(n - 1) + 1
         while not are_relatively_prime(d, phi):
-            d = randint(1, n)
-        e = pow(d, -1, phi)
+            d = randbelow(n - 1) + 1
+        e = mod_inverse(d, phi)
         return (d, n), (e, n)
 
     @staticmethod
@@ -54,10 +68,10 @@ class RSA:
         return ''.join(map(RSA._int_to_str, encoded_message))
 
     def encrypt(self, message: str) -> tp.List[int]:
-        return [pow(m, *self._public_key) for m in RSA.encode_message(message)]
+        return [mod_pow(m, *self._public_key) for m in RSA.encode_message(message)]
 
     def decrypt(self, message: tp.List[int]) -> str:
-        return RSA.decode_message([pow(m, *self._private_key) for m in message])
+        return RSA.decode_message([mod_pow(m, *self._private_key) for m in message])
 
 
 def main() -> None:
@@ -1,6 +1,6 @@
 import typing as tp
-from numpy.random import randint
-from functions import factorize, is_prime
+from secrets import randbelow
+from functions import factorize, is_prime, mod_pow
 
 
 class ElGamal:
@@ -10,11 +10,11 @@ class ElGamal:
         """
         assert is_prime(p)
         self.p = p
-        self.session_key = randint(1, self.p)
-        self.x = randint(1, self.p)
+        self.session_key = randbelow(self.p - 1) + 1
+        self.x = randbelow(self.p - 1) + 1
         self.g = self.find_primitive_root()
         assert self.g is not None
-        self.y = pow(self.g, self.x, self.p)
+        self.y = mod_pow(self.g, self.x, self.p)
 
     def find_primitive_root(self) -> tp.Optional[int]:
         """
@@ -26,7 +26,7 @@ class ElGamal:
         for i in range(2, self.p - 1):
             flag = False
             for key in factorize(self.p - 1).keys():
-                if pow(i, (self.p - 1) // key, self.p) == 1:
+                if mod_pow(i, (self.p - 1) // key, self.p) == 1:
                     flag = True
                     break
             if not flag:
@@ -65,13 +65,14 @@ class ElGamal:
         return ''.join(map(ElGamal._int_to_str, encoded_message))
 
     def encrypt(self, message: str) -> tp.Tuple[int, tp.List[int]]:
-        first = pow(self.g, self.session_key, self.p)
-        second = [(item * pow(self.y, self.session_key, self.p)) % self.p
-                  for item in ElGamal.encode_message(message)]
+        first = mod_pow(self.g, self.session_key, self.p)
+        shared_key = mod_pow(self.y, self.session_key, self.p)
+        second = [(item * shared_key) % self.p for item in ElGamal.encode_message(message)]
         return first, second
 
     def decrypt(self, first: int, second: tp.List[int]) -> str:
-        return ElGamal.decode_message([item * pow(first, -self.x, self.p) % self.p for item in second])
+        shared_key_inverse = mod_pow(first, -self.x, self.p)
+        return ElGamal.decode_message([item * shared_key_inverse % self.p for item in second])
 
 
 def main() -> None:
@@ -3,7 +3,7 @@ import typing as tp
 from bitarray import bitarray
 from bitarray.util import ba2int, int2ba
 
-from functions import left_cycle_shift
+from functions import left_cycle_shift, read_bits, write_bits
 
 
 class MD5:
@@ -45,7 +45,8 @@ class MD5:
         self.c_register = int2ba(0xFEDCBA98, length=32)
         self.d_register = int2ba(0x76543210, length=32)
 
-    def hash_message(self, message: bitarray) -> bitarray:
+    @staticmethod
+    def _pad_message(message: bitarray) -> bitarray:
         extended_message = message.copy()
         extended_message.extend([1])
 
@@ -53,6 +54,10 @@ class MD5:
             bits_to_extend_amount = ((447 + 512) - len(message) % 512) % 512
             extended_message.extend([0] * bits_to_extend_amount)
         extended_message.extend(int2ba(len(message) % (2 ** 64), length=64))
+        return extended_message
+
+    def hash_message(self, message: bitarray) -> bitarray:
+        extended_message = self._pad_message(message)
 
         self.__reset_registers()
         for chunk_no in range(len(extended_message) // 512):
@@ -98,10 +103,7 @@ class MD5:
         return self.a_register + self.b_register + self.c_register + self.d_register
 
     def hash_file(self, input_file: tp.BinaryIO, output_file: tp.BinaryIO) -> None:
-        input_file_message = bitarray()
-        input_file_message.fromfile(input_file)
-        hashed_input_file_message = self.hash_message(input_file_message)
-        hashed_input_file_message.tofile(output_file)
+        write_bits(self.hash_message(read_bits(input_file)), output_file)
 
 
 def main() -> None:
@@ -1,6 +1,9 @@
 import typing as tp
-from numpy.random import randint
-from functions import is_prime, modular_multiplicative_inverse, get_message_hash, factorize
+from collections import defaultdict
+from secrets import randbelow, randbits
+from functions import is_prime, modular_multiplicative_inverse, get_message_hash, factorize, \
+    get_cached_message_hash, jacobi_symbol, mod_inverse, mod_pow, multi_pow
+from signature import Signature, generate_deterministic_nonces
 
 
 class DigitalSignature:
@@ -16,27 +19,142 @@ class DigitalSignature:
             raise ValueError('q should be a divider of p - 1')
         self.p = p
         self.q = q
-        self.g = pow(modular_multiplicative_inverse(q, p), (p - 1) // q, p)
+        self.g = mod_pow(modular_multiplicative_inverse(q, p), (p - 1) // q, p)
         self.r = 0
         self.s = 0
-        self._private_key = randint(1, q)
-        self._session_key = randint(1, q)
-        self.public_key = pow(self.g, self._private_key, self.p)
+        self._private_key = randbelow(q - 1) + 1
+        self._session_key = randbelow(q - 1) + 1
+        self.public_key = mod_pow(self.g, self._private_key, self.p)
+
+    @property
+    def private_key(self) -> int:
+        """
+        :return: private key generated for this instance, the key public_key belongs to
+        """
+        return self._private_key
 
     def get_signature(self, message: str) -> tp.Tuple[int, int]:
         hashed_message = get_message_hash(message) % self.p
-        self.r = pow(self.g, self._session_key, self.p) % self.q
+        self.r = mod_pow(self.g, self._session_key, self.p) % self.q
         self.s = (self._session_key * hashed_message + self._private_key * self.r) % self.q
         return self.r, self.s
 
+    def sign(self, message: str, private_key: int) -> Signature:
+        """
+        Stateless version of get_signature: session key is derived from the private key and the message
+        (RFC 6979), so nothing is written to the instance and it can be shared between threads.
+        Same calling convention as lab7.DigitalSignature.sign
+        :param message: message to sign
+        :param private_key: private key of the signer, private_key of this instance for its own public_key
+        :return: signature (r, s)
+        """
+        hashed_message = get_cached_message_hash(message) % self.p
+        for session_key in generate_deterministic_nonces(private_key, get_cached_message_hash(message), self.q):
+            r = mod_pow(self.g, session_key, self.p) % self.q
+            s = (session_key * hashed_message + private_key * r) % self.q
+            if r != 0 and s != 0:
+                return Signature(r, s)
+
     def verify_signature(self, message: str) -> bool:
         hashed_message = get_message_hash(message) % self.p
-        w = pow(hashed_message, -1, self.q)
+        w = mod_inverse(hashed_message, self.q)
         u1 = w * self.s % self.q
         u2 = (self.q - self.r) * w % self.q
-        v = pow(self.g, u1, self.p) * pow(self.public_key, u2, self.p) % self.p % self.q
+        v = mod_pow(self.g, u1, self.p) * mod_pow(self.public_key, u2, self.p) % self.p % self.q
         return v == self.r
 
+    def _get_commitment(self, message: str, r: int, s: int, public_key: int) -> tp.Optional[int]:
+        """
+        Calculates g ** k (mod p) the signature was made with, using one simultaneous exponentiation
+        :return: g ** k (mod p) or None if signature values are malformed
+        """
+        if not (0 < r < self.q and 0 < s < self.q):
+            return None
+        hashed_message = get_cached_message_hash(message) % self.p
+        if hashed_message % self.q == 0:
+            return None
+        w = mod_inverse(hashed_message, self.q)
+        u1 = w * s % self.q
+        u2 = (self.q - r) * w % self.q
+        return multi_pow([(self.g, u1), (public_key, u2)], self.p)
+
+    def verify(self, message: str, r: int, s: int, public_key: int) -> bool:
+        """
+        Stateless version of verify_signature, which doesn't rely on the last signature made by this instance
+        :param message: signed message
+        :param r: first part of the signature
+        :param s: second part of the signature
+        :param public_key: public key of the signer
+        :return: True/False whether signature is correct or not
+        """
+        commitment = self._get_commitment(message, r, s, public_key)
+        return commitment is not None and commitment % self.q == r
+
+    def _recover_commitment(self, r: int) -> tp.Optional[int]:
+        """
+        For p = 2q + 1 the only candidates for g ** k (mod p) are r and r + q,
+        and exactly the quadratic residues modulo p belong to the subgroup generated by g
+        :param r: first part of the signature
+        :return: g ** k (mod p) if it is determined uniquely, None otherwise
+        """
+        candidates = [candidate for candidate in (r, r + self.q) if jacobi_symbol(candidate, self.p) == 1]
+        return candidates[0] if len(candidates) == 1 else None
+
+    def verify_batch(self, signatures: tp.Iterable[tp.Tuple[str, int, int, int]], randomized: bool = False,
+                     security_bits: int = 64) -> tp.List[bool]:
+        """
+        Verifies many signatures at once
+        :param signatures: tuples (message, r, s, public_key)
+        :param randomized: whether signatures made with the same public key should be checked together
+        with the small exponents test. It is only possible when p = 2q + 1, otherwise this flag is ignored
+        :param security_bits: bit length of random exponents, probability of accepting a batch
+        with an incorrect signature is at most 2 ** -security_bits
+        :return: verification result for every signature, in the same order
+        """
+        signatures = list(signatures)
+        if not randomized or self.p != 2 * self.q + 1:
+            return [self.verify(*signature) for signature in signatures]
+
+        results: tp.List[tp.Optional[bool]] = [None] * len(signatures)
+        batches: tp.Dict[int, tp.List[int]] = defaultdict(list)
+        for index, (message, r, s, public_key) in enumerate(signatures):
+            if not (0 < r < self.q and 0 < s < self.q) or get_cached_message_hash(message) % self.p % self.q == 0:
+                results[index] = False
+            elif self._recover_commitment(r) is None:
+                results[index] = self.verify(message, r, s, public_key)
+            else:
+                batches[public_key].append(index)
+
+        for public_key, indices in batches.items():
+            # exponents of y are reduced modulo q, which is only valid for keys from the subgroup of order q
+            if len(indices) == 1 or mod_pow(public_key, self.q, self.p) != 1 or not self._verify_same_key_batch(
+                    [signatures[index] for index in indices], public_key, security_bits):
+                for index in indices:
+                    results[index] = self.verify(*signatures[index])
+            else:
+                for index in indices:
+                    results[index] = True
+        return results
+
+    def _verify_same_key_batch(self, signatures: tp.List[tp.Tuple[str, int, int, int]], public_key: int,
+                               security_bits: int) -> bool:
+        """
+        Checks g ** sum(c * u1) * y ** sum(c * u2) == prod(R ** c) (mod p) for random c,
+        which costs about one exponentiation instead of two per signature
+        """
+        g_exponent, y_exponent = 0, 0
+        commitments_powers: tp.List[tp.Tuple[int, int]] = []
+        for message, r, s, _ in signatures:
+            hashed_message = get_cached_message_hash(message) % self.p
+            w = mod_inverse(hashed_message, self.q)
+            # the highest bit keeps c non-zero, the lower security_bits bits are all random
+            c = randbits(security_bits) | (1 << security_bits)
+            g_exponent += c * (w * s % self.q)
+            y_exponent += c * ((self.q - r) * w % self.q)
+            commitments_powers.append((self._recover_commitment(r), c))
+        left = multi_pow([(self.g, g_exponent % self.q), (public_key, y_exponent % self.q)], self.p)
+        return left == multi_pow(commitments_powers, self.p)
+
 
 def main() -> None:
     # prime = 33703
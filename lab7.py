@@ -1,71 +1,215 @@
 import typing as tp
+import codecs
+import json
+import os
+import tempfile
+import time
+from functools import lru_cache
+from hashlib import sha256
 from secrets import randbelow
 
 import tinyec.ec as ec
 from tinyec import registry
 
-from functions import get_message_hash
+from ec_arithmetic import AffinePoint, CurveArithmetic, get_curve_arithmetic
+from ec_serialization import CiphertextReader, CiphertextWriter
+from functions import get_message_hash, get_cached_message_hash, jacobi_symbol, mod_inverse, modular_sqrt
+from signature import Signature, generate_deterministic_nonces
 
 
-# making classes Point and Inf from tinyec hashable
-# so they can be used as a dict key in encoder
-ec.Point.__hash__ = lambda self: hash(self.x) ^ hash(self.y)
-ec.Inf.__hash__ = lambda self: hash(self.x) ^ hash(self.y)
+@lru_cache(maxsize=32)
+def _build_encoding_table(arithmetic: CurveArithmetic, multiplier: int) -> tp.Tuple[AffinePoint, ...]:
+    """
+    Builds points i * multiplier * G for i in [0, 255] incrementally, P_i = P_(i - 1) + P_1,
+    and converts them to affine coordinates with a single inversion.
+    Tables are shared by all encoders of the process with the same curve and multiplier
+    """
+    base = arithmetic.multiply_generator(multiplier)
+    jacobian_points = [arithmetic.to_jacobian(None)]
+    for _ in range(255):
+        jacobian_points.append(arithmetic.add_mixed(jacobian_points[-1], base))
+    return tuple(arithmetic.to_affine_batch(jacobian_points))
+
+
+@lru_cache(maxsize=32)
+def _load_encoding_table(arithmetic: CurveArithmetic, multiplier: int, cache_dir: str) -> \
+        tp.Tuple[AffinePoint, ...]:
+    """
+    Same as _build_encoding_table, but the table is stored in cache_dir and read from there next time,
+    then it is shared by all encoders of the process with the same curve, multiplier and cache_dir.
+    The file keeps a digest of the curve, the multiplier and all points, a file which doesn't match it
+    (truncated, corrupted or made for another table) is rebuilt. The file is replaced atomically, so
+    concurrent encoders never read a partially written table
+    """
+    table_id = sha256(repr((arithmetic.p, arithmetic.a, arithmetic.b, arithmetic.g, multiplier)).encode('UTF-8'))
+    path = os.path.join(cache_dir, f'encoding_table_{table_id.hexdigest()[:32]}.json')
+
+    def get_digest(points: tp.Any) -> str:
+        digest = table_id.copy()
+        digest.update(json.dumps(points).encode('UTF-8'))
+        return digest.hexdigest()
+
+    try:
+        with open(path, 'r') as f:
+            content = json.load(f)
+        if content['digest'] == get_digest(content['points']) and len(content['points']) == 256:
+            return tuple(None if point is None else tuple(point) for point in content['points'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    table = _build_encoding_table(arithmetic, multiplier)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(prefix='encoding_table_', suffix='.tmp', dir=cache_dir)
+        try:
+            with os.fdopen(file_descriptor, 'w') as f:
+                json.dump({'digest': get_digest(table), 'points': table}, f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    except OSError:
+        # the cache is only an optimization, the table is still usable
+        pass
+    return table
 
 
 class BaseEllipticCurveClass:
     """
     Base class for signature and encoder
     Implements key pair generation needed for both classes
+    and scalar multiplication with the selected engine:
+        'tinyec' - affine arithmetic of tinyec points, one inversion per addition
+        'jacobian' - ec_arithmetic in Jacobian coordinates, one inversion per multiplication
+        'ladder' - x-only Montgomery ladder with a fixed sequence of operations for secret scalars
+        (keys, session keys). It costs about 8x of the comb for the generator and 2x of wNAF for other points,
+        so scalars marked as public (secret=False) and signature verification still use 'jacobian' methods
     """
-    def __init__(self, curve: ec.Curve) -> None:
+    engines = ('tinyec', 'jacobian', 'ladder')
+
+    def __init__(self, curve: ec.Curve, engine: str = 'jacobian') -> None:
+        if engine not in self.engines:
+            raise ValueError(f'engine should be one of {self.engines}')
         self.curve = curve
+        self.engine = engine
+        self._arithmetic = get_curve_arithmetic(curve.field.p, curve.a, curve.b, curve.field.n,
+                                                (curve.g.x, curve.g.y))
+
+    @property
+    def arithmetic(self) -> CurveArithmetic:
+        return self._arithmetic
+
+    def to_point(self, point: AffinePoint) -> ec.Point:
+        """
+        :param point: affine coordinates of ec_arithmetic, None is the point at infinity
+        :return: tinyec point
+        """
+        if point is None:
+            return ec.Inf(self.curve)
+        return ec.Point(self.curve, *point)
+
+    @staticmethod
+    def from_point(point: ec.Point) -> AffinePoint:
+        if isinstance(point, ec.Inf):
+            return None
+        return point.x, point.y
+
+    def _negate(self, point: ec.Point) -> ec.Point:
+        return self.to_point(self._arithmetic.negate(self.from_point(point)))
+
+    def multiply(self, point: ec.Point, k: int, secret: bool = True) -> ec.Point:
+        """
+        :param secret: whether k is a key or a session key, only secret scalars are multiplied with the ladder
+        :return: k * point computed with the selected engine
+        """
+        if self.engine == 'tinyec':
+            return point * k
+        if self.engine == 'ladder' and secret:
+            return self.to_point(self._arithmetic.ladder_multiply(self.from_point(point), k))
+        return self.to_point(self._arithmetic.multiply(self.from_point(point), k))
+
+    def multiply_generator(self, k: int, secret: bool = True) -> ec.Point:
+        if self.engine == 'tinyec':
+            return self.curve.g * k
+        if self.engine == 'ladder' and secret:
+            return self.to_point(self._arithmetic.ladder_multiply(self._arithmetic.g, k))
+        return self.to_point(self._arithmetic.multiply_generator(k))
 
     def generate_key_pair(self) -> tp.Tuple[int, ec.Point]:
         private_key = randbelow(self.curve.field.n - 1) + 1
-        public_key = self.curve.g * private_key
+        public_key = self.multiply_generator(private_key)
         return private_key, public_key
 
 
 class DigitalSignature(BaseEllipticCurveClass):
-    def __init__(self, curve: ec.Curve) -> None:
-        super().__init__(curve)
-        self._private_key = 0
-
     def get_signature(self, message: str) -> tp.Tuple[int, int, ec.Point]:
         key, public_key = self.generate_key_pair()
-        r, s = 0, 0
-        hashed_message = get_message_hash(message)
-        while r == 0 or s == 0:
-            self._private_key = randbelow(self.curve.field.n - 1) + 1
-            point = self.curve.g * self._private_key
-            r = point.x % self.curve.field.n
-            try:
-                s = pow(self._private_key, -1, self.curve.field.n) * (hashed_message + key * r) % \
-                    self.curve.field.n
-                pow(s, -1, self.curve.field.n)
-            except ValueError:
-                s = 0
-        return r, s, public_key
+        signature = self.sign(message, key)
+        return signature.r, signature.s, public_key
+
+    def sign(self, message: str, private_key: int) -> Signature:
+        """
+        Signs message without touching instance state: session key is derived
+        from the private key and the message (RFC 6979)
+        :param message: message to sign
+        :param private_key: private key of the signer
+        :return: signature (r, s)
+        """
+        n = self.curve.field.n
+        hashed_message = get_cached_message_hash(message)
+        for session_key in generate_deterministic_nonces(private_key, hashed_message, n):
+            r = self.multiply_generator(session_key).x % n
+            s = mod_inverse(session_key, n) * (hashed_message + private_key * r) % n
+            if r != 0 and s != 0:
+                return Signature(r, s)
 
     def verify_signature(self, message: str, r: int, s: int, public_key: ec.Point) -> bool:
+        n = self.curve.field.n
+        if not (0 < r < n and 0 < s < n):
+            return False
         hashed_message = get_message_hash(message)
-        w = pow(s, -1, self.curve.field.n)
-        u1 = hashed_message * w % self.curve.field.n
-        u2 = r * w % self.curve.field.n
-        point = self.curve.g * u1 + public_key * u2
-        return point.x == r
+        w = mod_inverse(s, n)
+        u1 = hashed_message * w % n
+        u2 = r * w % n
+        if self.engine == 'tinyec':
+            point = self.curve.g * u1 + public_key * u2
+        else:
+            point = self.to_point(self._arithmetic.linear_combination([(self._arithmetic.g, u1),
+                                                                         (self.from_point(public_key), u2)]))
+        return not isinstance(point, ec.Inf) and point.x % n == r
 
 
 class Encoder(BaseEllipticCurveClass):
-    def __init__(self, curve: ec.Curve):
-        super().__init__(curve)
-        multiplier = randbelow(self.curve.field.n - 1) + 1
-        self._encoding_table = {
-            i: curve.g * multiplier * i for i in range(256)
-        }
+    embeddings = ('table', 'koblitz')
+    # x coordinate of an embedded block is block * 2^8 + j for the first j giving a curve point
+    _koblitz_padding_bits = 8
+
+    def __init__(self, curve: ec.Curve, engine: str = 'jacobian', multiplier: tp.Optional[int] = None,
+                 table_cache_dir: tp.Optional[str] = None, embedding: str = 'table'):
+        """
+        :param curve: elliptic curve
+        :param engine: scalar multiplication engine, see BaseEllipticCurveClass
+        :param embedding: how message is converted to points:
+            'table' - every byte is mapped to its own point with the encoding table
+            'koblitz' - blocks of block_size bytes are embedded into x coordinates of points
+        :param multiplier: byte i is encoded as point i * multiplier * G, random if not given.
+        Encoders with the same multiplier can decode messages of each other
+        :param table_cache_dir: directory to store encoding tables in, tables are not stored if not given
+        """
+        super().__init__(curve, engine)
+        if embedding not in self.embeddings:
+            raise ValueError(f'embedding should be one of {self.embeddings}')
+        self.embedding = embedding
+        # one bit is reserved for the leading marker, which keeps leading zero bytes of the block
+        self.block_size = (curve.field.p.bit_length() - 1 - self._koblitz_padding_bits - 1) // 8
+        self.multiplier = randbelow(self.curve.field.n - 1) + 1 if multiplier is None else multiplier
+        if table_cache_dir is None:
+            table = _build_encoding_table(self._arithmetic, self.multiplier)
+        else:
+            table = _load_encoding_table(self._arithmetic, self.multiplier, table_cache_dir)
+        self._encoding_table = [self.to_point(point) for point in table]
         self._decoding_table = {
-            curve.g * multiplier * i: i for i in range(256)
+            None if point is None else point[0]: i for i, point in enumerate(table)
         }
 
     def _message_to_points(self, message: str) -> tp.List[ec.Point]:
@@ -75,8 +219,14 @@ class Encoder(BaseEllipticCurveClass):
         :param message: message for further encoding
         :return: message, converted to points
         """
+        return self._bytes_to_points(message.encode('UTF-8'))
+
+    def _bytes_to_points(self, encoded_message: bytes) -> tp.List[ec.Point]:
+        if self.embedding == 'koblitz':
+            return [self.to_point(self._embed_block(encoded_message[i: i + self.block_size]))
+                    for i in range(0, len(encoded_message), self.block_size)]
         result: tp.List[ec.Point] = []
-        for byte in message.encode('UTF-8'):
+        for byte in encoded_message:
             result.append(self._encoding_table[byte])
         return result
 
@@ -86,24 +236,118 @@ class Encoder(BaseEllipticCurveClass):
         :param points: decrypted sequence of points
         :return: decrypted message
         """
-        message: tp.List[str] = []
-        for point in points:
-            message.append(self._decoding_table[point])
-        return ''.join(map(chr, message))
+        if self.embedding == 'koblitz':
+            return self._points_to_bytes(points).decode('UTF-8')
+        return ''.join(map(chr, self._points_to_bytes(points)))
+
+    def _points_to_bytes(self, points: tp.List[ec.Point]) -> bytes:
+        if self.embedding == 'koblitz':
+            return b''.join(self._extract_block(point) for point in points)
+        return bytes(self._decoding_table[point.x] for point in points)
+
+    def _embed_block(self, block: bytes) -> tp.Tuple[int, int]:
+        """
+        Koblitz embedding: tries x = m * 2^8, m * 2^8 + 1, ... until x^3 + ax + b is a square (mod p)
+        :param block: at most block_size bytes
+        :return: point, whose x coordinate holds the block
+        """
+        assert len(block) <= self.block_size
+        p = self.curve.field.p
+        shifted_block = int.from_bytes(b'\x01' + block, byteorder='big') << self._koblitz_padding_bits
+        for j in range(1 << self._koblitz_padding_bits):
+            x = shifted_block + j
+            right_side = (x * x * x + self.curve.a * x + self.curve.b) % p
+            # Jacobi symbol is much cheaper than the square root, so non-residues are filtered out with it
+            if jacobi_symbol(right_side, p) == -1:
+                continue
+            return x, modular_sqrt(right_side, p)
+        raise ValueError('Block can not be embedded into the curve')
+
+    def _extract_block(self, point: ec.Point) -> bytes:
+        block = point.x >> self._koblitz_padding_bits
+        return block.to_bytes((block.bit_length() + 7) // 8, byteorder='big')[1:]
+
+    def _add_to_all(self, points: tp.List[ec.Point], addend: ec.Point) -> tp.List[ec.Point]:
+        if self.engine == 'tinyec':
+            return [point + addend for point in points]
+        return [self.to_point(point) for point in self._arithmetic.add_to_many(
+            [self.from_point(point) for point in points], self.from_point(addend))]
 
     def encode(self, message: str, public_key: ec.Point) -> tp.Tuple[tp.List[ec.Point], ec.Point]:
         assert self.curve == public_key.curve
         assert len(message)
         points = self._message_to_points(message)
         k = randbelow(self.curve.field.n - 1) + 1
-        encoded_message = [point + public_key * k for point in points]
-        return encoded_message, self.curve.g * k
+        shared_point = self.multiply(public_key, k)
+        return self._add_to_all(points, shared_point), self.multiply_generator(k)
 
     def decode(self, encoded_message: tp.List[ec.Point], private_key: int, public_key: ec.Point) -> str:
         assert self.curve == encoded_message[0].curve
         assert self.curve == public_key.curve
-        return self._points_to_message([encoded_char - public_key * private_key
-                                       for encoded_char in encoded_message])
+        shared_point = self.multiply(public_key, private_key)
+        return self._points_to_message(self._add_to_all(encoded_message, self._negate(shared_point)))
+
+    def encode_to_file(self, message: str, public_key: ec.Point, output_file: tp.BinaryIO,
+                       compressed: bool = True, chunk_size: int = 4096) -> None:
+        """
+        Encodes message and writes it in binary format of ec_serialization.CiphertextWriter chunk by chunk,
+        so only chunk_size points are kept in memory at once
+        :param compressed: whether points should be written in compressed form (half the size)
+        :param chunk_size: maximal amount of points encoded at once
+        """
+        assert self.curve == public_key.curve
+        assert len(message)
+        encoded_message = message.encode('UTF-8')
+        k = randbelow(self.curve.field.n - 1) + 1
+        shared_point = self.multiply(public_key, k)
+        writer = CiphertextWriter(output_file, self._arithmetic, self.from_point(self.multiply_generator(k)),
+                                  compressed)
+        bytes_per_chunk = chunk_size * (self.block_size if self.embedding == 'koblitz' else 1)
+        for i in range(0, len(encoded_message), bytes_per_chunk):
+            points = self._add_to_all(self._bytes_to_points(encoded_message[i: i + bytes_per_chunk]), shared_point)
+            writer.write_points(self.from_point(point) for point in points)
+
+    def decode_file(self, input_file: tp.BinaryIO, private_key: int) -> str:
+        """
+        Reads file written by encode_to_file chunk by chunk and decodes it
+        """
+        reader = CiphertextReader(input_file, self._arithmetic)
+        shared_point = self._negate(self.multiply(self.to_point(reader.public_key), private_key))
+        if self.embedding == 'koblitz':
+            decode_chunk = codecs.getincrementaldecoder('UTF-8')().decode
+        else:
+            decode_chunk = lambda data: ''.join(map(chr, data))  # noqa
+        message: tp.List[str] = []
+        for points in reader.read_points():
+            decoded_points = self._add_to_all([self.to_point(point) for point in points], shared_point)
+            message.append(decode_chunk(self._points_to_bytes(decoded_points)))
+        if self.embedding == 'koblitz':
+            message.append(decode_chunk(b'', final=True))
+        return ''.join(message)
+
+
+def benchmark_engines(curve: ec.Curve, iterations: int = 20) -> tp.Dict[str, tp.Dict[str, float]]:
+    """
+    Measures average time of generator and variable base multiplications for every engine
+    :param curve: elliptic curve
+    :param iterations: amount of multiplications of each kind
+    :return: seconds per multiplication for every engine
+    """
+    scalars = [randbelow(curve.field.n - 1) + 1 for _ in range(iterations)]
+    point = curve.g * (randbelow(curve.field.n - 1) + 1)
+    result: tp.Dict[str, tp.Dict[str, float]] = {}
+    for engine in BaseEllipticCurveClass.engines:
+        base = BaseEllipticCurveClass(curve, engine)
+        base.multiply_generator(1)
+        start = time.perf_counter()
+        for k in scalars:
+            base.multiply_generator(k)
+        generator_time = (time.perf_counter() - start) / iterations
+        start = time.perf_counter()
+        for k in scalars:
+            base.multiply(point, k)
+        result[engine] = {'generator': generator_time, 'variable_base': (time.perf_counter() - start) / iterations}
+    return result
 
 
 def test_signature() -> None:
@@ -125,11 +369,10 @@ def test_encoder() -> None:
     first_private_key, first_public_key = encoder.generate_key_pair()
     with open('input_files/input_lab7_cipher.txt', 'r') as f:
         message = f.read()
-    encoded_message, public_key = encoder.encode(message, first_public_key)
-    with open('output_files/output_lab7_encoded_message', 'w') as f:
-        f.write('public key: ' + str(public_key) + '\n\n')
-        f.writelines([str(point) + '\n' for point in encoded_message])
-    decoded_message = encoder.decode(encoded_message, first_private_key, public_key)
+    with open('output_files/output_lab7_encoded_message', 'wb') as f:
+        encoder.encode_to_file(message, first_public_key, f)
+    with open('output_files/output_lab7_encoded_message', 'rb') as f:
+        decoded_message = encoder.decode_file(f, first_private_key)
     with open('output_files/output_lab7_message', 'w') as f:
         f.write(decoded_message)
 
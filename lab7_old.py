@@ -1,54 +1,73 @@
 import typing as tp
 
+from math import isqrt
 from numpy.random import randint
-from functions import is_prime, modular_multiplicative_inverse, factorize, are_relatively_prime
+from ec_arithmetic import AffinePoint, CurveArithmetic
+from functions import is_prime, factorize, are_relatively_prime, jacobi_symbol, modular_sqrt
 
 
 class Point:
+    """
+    Immutable point of EllipticCurve, None coordinates stand for the point at infinity (identity element).
+    Coordinates are only validated when a point is constructed from outside, results of the arithmetic
+    are on the curve by construction. Arithmetic itself is done by ec_arithmetic in Jacobian coordinates,
+    scalar multiplication uses its Montgomery ladder, so the sequence of operations doesn't depend on the scalar
+    """
+    __slots__ = ('ec', 'x', 'y')
+
     def __init__(self, ec: 'EllipticCurve', x: tp.Optional[int], y: tp.Optional[int]) -> None:
-        self.ec = ec
-        self.x = x
-        self.y = y
         assert not (x is None) ^ (y is None)
+        if x is not None:
+            x, y = x % ec.p, y % ec.p
+        object.__setattr__(self, 'ec', ec)
+        object.__setattr__(self, 'x', x)
+        object.__setattr__(self, 'y', y)
         assert ec.point_belongs_elliptic_curve(self)
 
+    @classmethod
+    def _from_affine(cls, ec: 'EllipticCurve', point: AffinePoint) -> 'Point':
+        """
+        Creates point without validation, only for points known to be on the curve
+        """
+        result = object.__new__(cls)
+        object.__setattr__(result, 'ec', ec)
+        object.__setattr__(result, 'x', None if point is None else point[0])
+        object.__setattr__(result, 'y', None if point is None else point[1])
+        return result
+
+    @classmethod
+    def infinity(cls, ec: 'EllipticCurve') -> 'Point':
+        return cls._from_affine(ec, None)
+
+    def _to_affine(self) -> AffinePoint:
+        return None if self.is_infinite() else (self.x, self.y)
+
+    def __setattr__(self, key: str, value: tp.Any) -> None:
+        raise AttributeError('Point is immutable')
+
     def __neg__(self) -> 'Point':
-        return Point(self.ec, self.x, -self.y)
+        return Point._from_affine(self.ec, self.ec.arithmetic.negate(self._to_affine()))
 
     def __add__(self, other: 'Point') -> 'Point':
-        if self.is_infinite():
-            return other
-        elif other.is_infinite():
-            return self
-        elif other == -self:
-            return Point(self.ec, None, None)
-        try:
-            if self != other:
-                l = (other.y - self.y) * modular_multiplicative_inverse(other.x - self.x, self.ec.p)
-            else:
-                l = (3 * self.x ** 2 + self.ec.a) * modular_multiplicative_inverse(2 * self.y, self.ec.p)
-            x = (l ** 2 - self.x - other.x) % self.ec.p
-            y = (l * (self.x - x) - self.y) % self.ec.p
-            return Point(self.ec, x, y)
-        except ZeroDivisionError:
-            return Point(self.ec, None, None)
-        except AssertionError:
-            return Point(self.ec, None, None)
+        return Point._from_affine(self.ec, self.ec.arithmetic.add_affine(self._to_affine(), other._to_affine()))
+
+    def __sub__(self, other: 'Point') -> 'Point':
+        return self + (-other)
+
+    def multiply(self, n: int, secret: bool = True) -> 'Point':
+        """
+        :param secret: whether n is a key or a session key, public scalars use the faster wNAF multiplication
+        :return: n * point
+        """
+        if secret:
+            return Point._from_affine(self.ec, self.ec.arithmetic.ladder_multiply(self._to_affine(), n))
+        return Point._from_affine(self.ec, self.ec.arithmetic.multiply(self._to_affine(), n))
 
     def __mul__(self, n: int) -> 'Point':
-        if n == 0:
-            return Point(self.ec, None, None)
-        result = self
-        n -= 1
-        current = self
-        while n > 0:
-            if n % 2 == 0:
-                current += current
-                n //= 2
-            else:
-                result += current
-                n -= 1
-        return result
+        return self.multiply(n)
+
+    def __rmul__(self, n: int) -> 'Point':
+        return self * n
 
     def is_infinite(self) -> bool:
         return self.x is None
@@ -56,6 +75,9 @@ class Point:
     def __eq__(self, other) -> bool:
         return self.x == other.x and self.y == other.y
 
+    def __hash__(self) -> int:
+        return hash((self.x, self.y))
+
     def __str__(self) -> str:
         return f'({self.x}, {self.y})'
 
@@ -69,8 +91,11 @@ class EllipticCurve:
         self.a = a
         self.b = b
         self.p = p
+        self.arithmetic = CurveArithmetic(p, a, b)
         self.g = Point(self, *g)
         self.finite_field = self._get_finite_field()
+        # points of the curve and the point at infinity
+        self.order = len(self.finite_field) + 1
         # self.g = self.finite_field[randint(0, len(self.finite_field))]
         self.n = list(factorize(EllipticCurve._get_point_order(self.g) + 1).keys())[-1]
         # print(self.g, self.n)
@@ -80,25 +105,61 @@ class EllipticCurve:
 
     def _get_finite_field(self) -> tp.List[Point]:
         """
-        Used to find suitable points for elliptic curve
+        Used to find suitable points for elliptic curve.
+        For every x Legendre symbol of x^3 + ax + b tells whether there are 0, 1 or 2 suitable values of y,
+        so only p values have to be checked instead of p^2 pairs
         :return: list of all points (except infinite point)
         """
         result: tp.List = []
         for x in range(self.p):
-            for y in range(self.p):
-                try:
-                    point = Point(self, x, y)
-                    result.append(point)
-                except AssertionError:
-                    pass
+            right_side = (x ** 3 + self.a * x + self.b) % self.p
+            symbol = jacobi_symbol(right_side, self.p)
+            if symbol == 0:
+                result.append(Point._from_affine(self, (x, 0)))
+            elif symbol == 1:
+                y = modular_sqrt(right_side, self.p)
+                result.append(Point._from_affine(self, (x, min(y, self.p - y))))
+                result.append(Point._from_affine(self, (x, max(y, self.p - y))))
 
         return result
 
     @staticmethod
     def _get_point_order(point: Point) -> int:
-        order = 2
-        while not (point * order).is_infinite():
-            order += 1
+        """
+        Order of the group lies in Hasse interval [p + 1 - 2 sqrt(p), p + 1 + 2 sqrt(p)],
+        so its multiple, annihilating the point, is found with baby-step giant-step in O(p^(1/4)) operations.
+        Then it is divided by its prime factors while the point is still annihilated
+        :param point: some point of the curve
+        :return: smallest positive n such that n * point is the point at infinity
+        """
+        p = point.ec.p
+        lower_bound = p + 1 - 2 * isqrt(p) - 2
+        steps_amount = isqrt(4 * isqrt(p) + 4) + 2
+
+        baby_steps: tp.Dict[tp.Tuple[tp.Optional[int], tp.Optional[int]], int] = {}
+        current = Point.infinity(point.ec)
+        for j in range(steps_amount + 1):
+            baby_steps.setdefault((current.x, current.y), j)
+            current = current + point
+
+        giant_step = point.multiply(steps_amount, secret=False)
+        current = point.multiply(lower_bound, secret=False)
+        multiple = 0
+        for i in range(steps_amount + 1):
+            if (current.x, current.y) in baby_steps:
+                multiple = lower_bound + i * steps_amount - baby_steps[(current.x, current.y)]
+            elif not current.is_infinite() and (current.x, -current.y % p) in baby_steps:
+                multiple = lower_bound + i * steps_amount + baby_steps[(current.x, -current.y % p)]
+            if multiple > 0:
+                break
+            multiple = 0
+            current = current + giant_step
+        assert multiple > 0
+
+        order = multiple
+        for prime in factorize(multiple).keys():
+            while order % prime == 0 and point.multiply(order // prime, secret=False).is_infinite():
+                order //= prime
         return order
 
     def point_belongs_elliptic_curve(self, point: Point) -> bool:
@@ -137,7 +198,7 @@ class EllipticCurve:
         u1 = message * w % self.n
         u2 = r * w % self.n
         print(u1, u2)
-        point = self.g * u1 + public_key * u2
+        point = self.g.multiply(u1, secret=False) + public_key.multiply(u2, secret=False)
         print(point)
         return point.x == r
 
@@ -1,24 +1,32 @@
+import typing as tp
+import argparse
+import os
+import struct
+import zlib
 import numpy as np
-import matplotlib.pyplot as plt
 
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 
 
-with Image.open('picture.jpg') as image:
-    plt.imshow(image)
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.tif', '.tiff', '.jpg', '.jpeg')
+
+# framed payload: magic || bits per channel value || payload length || crc32 of payload.
+# Header is always written with 1 bit per value, the payload follows it with the given depth
+PAYLOAD_MAGIC = b'MZ'
+HEADER_FORMAT = '>2sBII'
+HEADER_LENGTH = struct.calcsize(HEADER_FORMAT)
+MAX_DEPTH = 4
 
 
 def encode(image: Image, message: str) -> Image:
     image_array = np.moveaxis(np.array(image, dtype='uint8'), -1, 0)
     arr = image_array.flatten()
-    encoded_message = message.encode('UTF-8')
-    curr = 0
-    for byte in encoded_message:
-        for i in range(8):
-            arr[curr] -= (arr[curr] & 1)
-            if (byte & (1 << i)) > 0:
-                arr[curr] += 1
-            curr += 1
+    # i-th bit of every byte (starting from the least significant one) goes to the lowest bit of the next array item
+    message_bits = np.unpackbits(np.frombuffer(message.encode('UTF-8'), dtype=np.uint8), bitorder='little')
+    if len(message_bits) > len(arr):
+        raise ValueError('Message is too long for this image')
+    arr[:len(message_bits)] = (arr[:len(message_bits)] & 0xFE) | message_bits
 
     return Image.fromarray(np.moveaxis(arr.reshape(image_array.shape), 0, -1))
 
@@ -26,22 +34,98 @@ def encode(image: Image, message: str) -> Image:
 def decode(image: Image, message_length: int) -> str:
     image_array = np.moveaxis(np.array(image, dtype='uint8'), -1, 0)
     arr = image_array.flatten()
-    result = []
-    for i in range(message_length):
-        curr = 0
-        for j in range(7, -1, -1):
-            curr = (curr << 1) + (arr[i * 8 + j] & 1)
-        result.append(chr(curr))
-    return ''.join(result)
+    message_bytes = np.packbits(arr[:message_length * 8] & 1, bitorder='little')
+    # every byte is converted to a character with the same code
+    return message_bytes.tobytes().decode('latin-1')
+
+
+def _channel_major_indices(shape: tp.Tuple[int, int, int], start: int, count: int) -> \
+        tp.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Values are used in the same order as in encode: channel by channel, row by row.
+    :return: indices of values [start, start + count) of this order in (height, width, channels) array
+    """
+    height, width, _ = shape
+    positions = np.arange(start, start + count)
+    channels, pixel_positions = np.divmod(positions, height * width)
+    rows, columns = np.divmod(pixel_positions, width)
+    return rows, columns, channels
+
+
+def _bytes_to_values(data: bytes, depth: int) -> np.ndarray:
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder='little')
+    bits = np.concatenate([bits, np.zeros(-len(bits) % depth, dtype=np.uint8)]).reshape(-1, depth)
+    return (bits << np.arange(depth, dtype=np.uint8)).sum(axis=1, dtype=np.uint8)
+
+
+def _values_to_bytes(values: np.ndarray, depth: int, length: int) -> bytes:
+    bits = ((values[:, np.newaxis] >> np.arange(depth, dtype=np.uint8)) & 1).astype(np.uint8).reshape(-1)
+    return np.packbits(bits[:length * 8], bitorder='little').tobytes()
+
+
+def _values_amount(length: int, depth: int) -> int:
+    return (length * 8 + depth - 1) // depth
 
 
-with open('message.txt', 'r') as f:
-    message = f.read()
+def get_capacity(image: Image, depth: int = 1) -> int:
+    """
+    :return: maximal length of payload in bytes, which can be embedded into the image with embed
+    """
+    width, height = image.size
+    # computed from the image metadata, so the pixels are not converted to an array
+    return max(0, (width * height * len(image.getbands()) - HEADER_LENGTH * 8) * depth // 8)
 
 
-with Image.open('picture.jpg') as image:
-    image_with_message = encode(image, message)
-    decoded_message = decode(image_with_message, len(message))
+def embed(image: Image, payload: bytes, depth: int = 1) -> Image:
+    """
+    Embeds framed payload into lowest bits of the image values, so extract needs no external information
+    :param image: container image
+    :param payload: bytes to embed
+    :param depth: amount of lowest bits of every channel value to use, from 1 to MAX_DEPTH
+    :return: image with payload
+    """
+    if not 1 <= depth <= MAX_DEPTH:
+        raise ValueError(f'depth should be from 1 to {MAX_DEPTH}')
+    if len(payload) > get_capacity(image, depth):
+        raise ValueError('Payload is too long for this image')
+    image_array = np.array(image, dtype='uint8')
+    values = image_array.reshape(image_array.shape[0], image_array.shape[1], -1)
+    header = struct.pack(HEADER_FORMAT, PAYLOAD_MAGIC, depth, len(payload), zlib.crc32(payload))
+    position = 0
+    for data, data_depth in ((header, 1), (payload, depth)):
+        indices = _channel_major_indices(values.shape, position, _values_amount(len(data), data_depth))
+        mask = np.uint8(0xFF ^ ((1 << data_depth) - 1))
+        values[indices] = (values[indices] & mask) | _bytes_to_values(data, data_depth)
+        position += len(indices[0])
+    return Image.fromarray(image_array)
+
+
+def extract(image: Image) -> bytes:
+    """
+    Extracts payload written by embed, only the values holding header and payload are read
+    :param image: image with payload
+    :return: payload
+    """
+    image_array = np.asarray(image, dtype='uint8')
+    values = image_array.reshape(image_array.shape[0], image_array.shape[1], -1)
+    if values.size < HEADER_LENGTH * 8:
+        raise ValueError('Image is too small to contain a payload')
+    header_values = values[_channel_major_indices(values.shape, 0, HEADER_LENGTH * 8)] & 1
+    magic, depth, length, checksum = struct.unpack(HEADER_FORMAT,
+                                                   _values_to_bytes(header_values, 1, HEADER_LENGTH))
+    if magic != PAYLOAD_MAGIC or not 1 <= depth <= MAX_DEPTH or length > get_capacity(image, depth):
+        raise ValueError('Image contains no payload')
+    payload_values = values[_channel_major_indices(values.shape, HEADER_LENGTH * 8, _values_amount(length, depth))]
+    payload = _values_to_bytes(payload_values & ((1 << depth) - 1), depth, length)
+    if zlib.crc32(payload) != checksum:
+        raise ValueError('Payload checksum mismatch')
+    return payload
+
+
+def show_comparison(image: Image, image_with_message: Image) -> None:
+    # matplotlib is heavy, so it is only imported when something has to be shown
+    import matplotlib.pyplot as plt
+
     fig, axes = plt.subplots(1, 2, figsize=(15, 6), sharey='all')
     fig.suptitle('Empty container image vs image with encoded message')
     axes[0].imshow(image)
@@ -49,5 +133,101 @@ with Image.open('picture.jpg') as image:
     plt.show()
 
 
-with open('decoded_message.txt', 'w') as f:
-    f.writelines(decoded_message)
+def _list_images(input_dir: str) -> tp.List[str]:
+    return sorted(name for name in os.listdir(input_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _embed_file(input_path: str, output_path: str, payload: bytes, depth: int) -> str:
+    with Image.open(input_path) as image:
+        embed(image.convert('RGB'), payload, depth).save(output_path, format='PNG')
+    return output_path
+
+
+def _extract_file(input_path: str, output_path: str) -> str:
+    with Image.open(input_path) as image:
+        payload = extract(image.convert('RGB'))
+    with open(output_path, 'wb') as f:
+        f.write(payload)
+    return output_path
+
+
+def embed_directory(input_dir: str, output_dir: str, payload: bytes, depth: int = 1,
+                    workers: tp.Optional[int] = None) -> tp.List[str]:
+    """
+    Embeds payload into every image of the directory using a pool of processes.
+    Results are saved as PNG, as lossy formats would destroy the lowest bits
+    :param input_dir: directory with container images
+    :param output_dir: directory for images with payload
+    :param payload: bytes to embed
+    :param depth: amount of lowest bits of every channel value to use
+    :param workers: amount of processes, os.cpu_count() by default
+    :return: paths of written images
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    names = _list_images(input_dir)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_embed_file, [os.path.join(input_dir, name) for name in names],
+                                 [os.path.join(output_dir, os.path.splitext(name)[0] + '.png') for name in names],
+                                 [payload] * len(names), [depth] * len(names)))
+
+
+def extract_directory(input_dir: str, output_dir: str, workers: tp.Optional[int] = None) -> tp.List[str]:
+    """
+    Extracts payloads from every image of the directory using a pool of processes
+    :param input_dir: directory with images with payload
+    :param output_dir: directory for extracted payloads, one .bin file per image
+    :param workers: amount of processes, os.cpu_count() by default
+    :return: paths of written payloads
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    names = _list_images(input_dir)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_extract_file, [os.path.join(input_dir, name) for name in names],
+                                 [os.path.join(output_dir, os.path.splitext(name)[0] + '.bin') for name in names]))
+
+
+def demo() -> None:
+    with open('message.txt', 'r') as f:
+        message = f.read()
+
+    with Image.open('picture.jpg') as image:
+        image_with_message = embed(image, message.encode('UTF-8'))
+        decoded_message = extract(image_with_message).decode('UTF-8')
+        show_comparison(image, image_with_message)
+
+    with open('decoded_message.txt', 'w') as f:
+        f.writelines(decoded_message)
+
+
+def main(argv: tp.Optional[tp.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='LSB steganography in images')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('demo', help='embed message.txt into picture.jpg and show both images')
+
+    embed_parser = subparsers.add_parser('embed', help='embed file into every image of a directory')
+    embed_parser.add_argument('input_dir')
+    embed_parser.add_argument('output_dir')
+    embed_parser.add_argument('payload_file')
+    embed_parser.add_argument('--depth', type=int, default=1, help=f'lowest bits per value, 1 to {MAX_DEPTH}')
+    embed_parser.add_argument('--workers', type=int, default=None)
+
+    extract_parser = subparsers.add_parser('extract', help='extract payloads from every image of a directory')
+    extract_parser.add_argument('input_dir')
+    extract_parser.add_argument('output_dir')
+    extract_parser.add_argument('--workers', type=int, default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == 'embed':
+        with open(args.payload_file, 'rb') as f:
+            payload = f.read()
+        for path in embed_directory(args.input_dir, args.output_dir, payload, args.depth, args.workers):
+            print(path)
+    elif args.command == 'extract':
+        for path in extract_directory(args.input_dir, args.output_dir, args.workers):
+            print(path)
+    else:
+        demo()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,446 @@
+import typing as tp
+import argparse
+import asyncio
+import base64
+import collections
+import dataclasses
+import io
+import json
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from algorithms import get_algorithm
+
+
+# every frame is a 4 byte big endian length followed by a UTF-8 JSON document
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_LENGTH = 64 << 20
+LATENCY_WINDOW = 10000
+
+
+@dataclasses.dataclass
+class KeyMaterial:
+    """
+    Keys are created once in the server process and copied into every worker, so all workers sign,
+    encrypt and decrypt with the same keys
+    """
+    cipher_keys: tp.Dict[str, bytes] = dataclasses.field(default_factory=dict)
+    rsa_keys: tp.Optional[tp.Tuple[tp.Tuple[int, int], tp.Tuple[int, int]]] = None
+    dsa: tp.Any = None
+
+
+_worker_state: tp.Dict[str, tp.Any] = {}
+
+
+def _init_worker(key_material: KeyMaterial) -> None:
+    from streaming import load_cipher
+    _worker_state['ciphers'] = {algorithm: load_cipher(algorithm, key)
+                                for algorithm, key in key_material.cipher_keys.items()}
+    if key_material.rsa_keys is not None:
+        _worker_state['rsa'] = get_algorithm('rsa')(*key_material.rsa_keys)
+    _worker_state['dsa'] = key_material.dsa
+    _worker_state['md5'] = get_algorithm('md5')()
+
+
+def _get_key(name: str) -> tp.Any:
+    if _worker_state.get(name) is None:
+        raise ValueError(f'No {name} key is loaded')
+    return _worker_state[name]
+
+
+def _process_cipher(operation: str, params: tp.Dict[str, tp.Any]) -> bytes:
+    from cli import decrypt_stream, encrypt_stream
+    if params['alg'] not in _worker_state['ciphers']:
+        raise ValueError(f'No {params["alg"]} key is loaded')
+    output = io.BytesIO()
+    process_stream = encrypt_stream if operation == 'encrypt' else decrypt_stream
+    process_stream(_worker_state['ciphers'][params['alg']], io.BytesIO(params['data']), output,
+                   params.get('mode', 'ecb'))
+    return output.getvalue()
+
+
+def _process_md5(params: tp.Dict[str, tp.Any]) -> str:
+    from bitarray import bitarray
+    message = bitarray()
+    message.frombytes(params['data'])
+    return _worker_state['md5'].hash_message(message).tobytes().hex()
+
+
+def _process_one(operation: str, params: tp.Dict[str, tp.Any]) -> tp.Any:
+    if operation in ('encrypt', 'decrypt'):
+        return _process_cipher(operation, params)
+    if operation == 'md5':
+        return _process_md5(params)
+    if operation == 'sign':
+        dsa = _get_key('dsa')
+        signature = dsa.sign(params['message'], dsa.private_key)
+        return {'r': signature.r, 's': signature.s}
+    if operation == 'rsa_encrypt':
+        return _get_key('rsa').encrypt(params['message'])
+    if operation == 'rsa_decrypt':
+        return _get_key('rsa').decrypt(params['data'])
+    raise ValueError(f'Unknown operation {operation}')
+
+
+def _process_batch(operation: str, batch: tp.List[tp.Dict[str, tp.Any]]) -> tp.List[tp.Tuple[bool, tp.Any]]:
+    """
+    Runs in a worker process
+    :return: (whether the request succeeded, result or error message) for every request of the batch
+    """
+    if operation == 'verify':
+        dsa = _worker_state.get('dsa')
+        if dsa is None:
+            return [(False, 'No dsa key is loaded')] * len(batch)
+        try:
+            verdicts = dsa.verify_batch([(params['message'], int(params['r']), int(params['s']),
+                                          int(params.get('public_key', dsa.public_key))) for params in batch],
+                                        randomized=True)
+            return [(True, verdict) for verdict in verdicts]
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    results = []
+    for params in batch:
+        try:
+            if operation == 'verify':
+                results.append((True, _get_key('dsa').verify(params['message'], int(params['r']), int(params['s']),
+                                                             int(params.get('public_key', dsa.public_key)))))
+            else:
+                results.append((True, _process_one(operation, params)))
+        except (KeyError, TypeError, ValueError) as e:
+            results.append((False, f'{type(e).__name__}: {e}'))
+    return results
+
+
+class LatencyStats:
+    """
+    Keeps the latest LATENCY_WINDOW latencies of every operation
+    """
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        self._latencies: tp.Dict[str, tp.Deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=window))
+        self._counts: tp.Dict[str, int] = collections.Counter()
+
+    def add(self, operation: str, seconds: float) -> None:
+        self._latencies[operation].append(seconds)
+        self._counts[operation] += 1
+
+    @staticmethod
+    def _percentile(sorted_values: tp.List[float], percent: float) -> float:
+        return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+    def get_summary(self) -> tp.Dict[str, tp.Dict[str, float]]:
+        result = {}
+        for operation, latencies in self._latencies.items():
+            values = sorted(latencies)
+            result[operation] = {'count': self._counts[operation],
+                                 'p50_ms': self._percentile(values, 50) * 1000,
+                                 'p95_ms': self._percentile(values, 95) * 1000,
+                                 'p99_ms': self._percentile(values, 99) * 1000}
+        return result
+
+
+class _Batcher:
+    """
+    Collects concurrent requests of one operation and sends them to a worker together
+    """
+    def __init__(self, server: 'Server', operation: str) -> None:
+        self._server = server
+        self._operation = operation
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.in_flight = 0
+        self.batch_sizes: tp.Deque[int] = collections.deque(maxlen=LATENCY_WINDOW)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def submit(self, params: tp.Dict[str, tp.Any]) -> tp.Tuple[bool, tp.Any]:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((params, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._server.max_batch_delay
+            while len(batch) < self._server.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self._queue.get_nowait())
+            await self._server.worker_slots.acquire()
+            loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: tp.List[tp.Tuple[tp.Dict[str, tp.Any], asyncio.Future]]) -> None:
+        self.in_flight += len(batch)
+        self.batch_sizes.append(len(batch))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._server.executor, _process_batch, self._operation, [params for params, _ in batch])
+        except Exception as e:
+            results = [(False, f'{type(e).__name__}: {e}')] * len(batch)
+        finally:
+            self.in_flight -= len(batch)
+            self._server.worker_slots.release()
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def close(self) -> None:
+        self._task.cancel()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tp.Any:
+    """
+    :return: decoded frame or None if the connection is closed, also in the middle of a frame
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    length, = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_LENGTH:
+        raise ValueError('Frame is too long')
+    try:
+        body = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return json.loads(body)
+
+
+def encode_frame(document: tp.Dict[str, tp.Any]) -> bytes:
+    body = json.dumps(document).encode('UTF-8')
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+class Server:
+    """
+    Requests: {"id": ..., "op": ..., parameters}, binary parameters and results are base64 encoded.
+    Operations:
+        encrypt/decrypt: alg, data, mode ('ecb' or 'ctr') - block ciphers with keys given at start
+        md5: data
+        sign: message; verify: message, r, s, public_key (server key by default) - lab6 signatures
+        rsa_encrypt: message; rsa_decrypt: data (list of integers)
+        stats: queue depth, requests in workers, latency percentiles and batch sizes
+    Responses: {"id": ..., "ok": true, "result": ...} or {"id": ..., "ok": false, "error": ...},
+    requests of one connection are processed concurrently, so responses may come in any order
+    """
+    operations = ('encrypt', 'decrypt', 'md5', 'sign', 'verify', 'rsa_encrypt', 'rsa_decrypt')
+    binary_parameters = ('data',)
+
+    def __init__(self, key_material: KeyMaterial, workers: tp.Optional[int] = None, max_batch_size: int = 64,
+                 max_batch_delay: float = 0.002) -> None:
+        """
+        :param key_material: keys to load into every worker
+        :param workers: amount of worker processes, os.cpu_count() by default
+        :param max_batch_size: maximal amount of requests sent to a worker at once
+        :param max_batch_delay: seconds to wait for more requests before sending a batch
+        """
+        self.key_material = key_material
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._workers = (os.cpu_count() or 1) if workers is None else workers
+        self.executor = ProcessPoolExecutor(max_workers=self._workers, initializer=_init_worker,
+                                            initargs=(key_material,))
+        # keeps every worker busy with one batch and one more waiting, other requests wait in the queues
+        self.worker_slots: tp.Optional[asyncio.Semaphore] = None
+        self.latencies = LatencyStats()
+        self._batchers: tp.Dict[str, _Batcher] = {}
+
+    def _get_batcher(self, operation: str) -> _Batcher:
+        if self.worker_slots is None:
+            self.worker_slots = asyncio.Semaphore(2 * self._workers)
+        if operation not in self._batchers:
+            self._batchers[operation] = _Batcher(self, operation)
+        return self._batchers[operation]
+
+    def get_stats(self) -> tp.Dict[str, tp.Any]:
+        return {
+            'queue_depth': {operation: batcher.queue_depth for operation, batcher in self._batchers.items()},
+            'in_flight': {operation: batcher.in_flight for operation, batcher in self._batchers.items()},
+            'mean_batch_size': {operation: sum(batcher.batch_sizes) / len(batcher.batch_sizes)
+                                for operation, batcher in self._batchers.items() if batcher.batch_sizes},
+            'latency': self.latencies.get_summary(),
+        }
+
+    async def handle_request(self, request: tp.Any) -> tp.Dict[str, tp.Any]:
+        """
+        :param request: decoded frame, anything but a JSON object is rejected
+        :return: response, unexpected errors are reported in it too, so every request gets one
+        """
+        if not isinstance(request, dict):
+            return {'id': None, 'ok': False, 'error': 'Request should be a JSON object'}
+        try:
+            return await self._handle_request(request)
+        except Exception as e:
+            return {'id': request.get('id'), 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+    async def _handle_request(self, request: tp.Dict[str, tp.Any]) -> tp.Dict[str, tp.Any]:
+        start = time.perf_counter()
+        operation = request.get('op')
+        response: tp.Dict[str, tp.Any] = {'id': request.get('id')}
+        if operation == 'stats':
+            response.update(ok=True, result=self.get_stats())
+            return response
+        if operation not in self.operations:
+            response.update(ok=False, error=f'Unknown operation {operation}')
+            return response
+        params = {key: value for key, value in request.items() if key not in ('id', 'op')}
+        try:
+            for key in self.binary_parameters:
+                if key in params and operation != 'rsa_decrypt':
+                    params[key] = base64.b64decode(params[key])
+        except (TypeError, ValueError) as e:
+            response.update(ok=False, error=f'Wrong {key}: {e}')
+            return response
+        ok, result = await self._get_batcher(operation).submit(params)
+        if ok and isinstance(result, bytes):
+            result = base64.b64encode(result).decode('ascii')
+        response.update({'ok': ok, 'result' if ok else 'error': result})
+        self.latencies.add(operation, time.perf_counter() - start)
+        return response
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        write_lock = asyncio.Lock()
+        tasks: tp.Set[asyncio.Task] = set()
+
+        async def respond(request: tp.Any) -> None:
+            response = await self.handle_request(request)
+            async with write_lock:
+                writer.write(encode_frame(response))
+                await writer.drain()
+
+        try:
+            while True:
+                try:
+                    request = await read_frame(reader)
+                except ValueError as e:
+                    async with write_lock:
+                        writer.write(encode_frame({'id': None, 'ok': False, 'error': str(e)}))
+                    break
+                if request is None:
+                    break
+                task = asyncio.get_running_loop().create_task(respond(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8470, unix_path: tp.Optional[str] = None) -> None:
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        for batcher in self._batchers.values():
+            batcher.close()
+        self.executor.shutdown(cancel_futures=True)
+
+
+class Client:
+    """
+    Minimal client, sends requests of one connection concurrently and matches responses by id
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._pending: tp.Dict[int, asyncio.Future] = {}
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_responses())
+
+    @classmethod
+    async def connect(cls, host: str = '127.0.0.1', port: int = 8470,
+                      unix_path: tp.Optional[str] = None) -> 'Client':
+        if unix_path is not None:
+            return cls(*await asyncio.open_unix_connection(unix_path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def _read_responses(self) -> None:
+        reason = 'Connection closed'
+        try:
+            while True:
+                response = await read_frame(self._reader)
+                if response is None:
+                    break
+                future = self._pending.pop(response.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (AttributeError, ValueError) as e:
+            reason = f'Malformed response: {e}'
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(reason))
+            self._pending.clear()
+
+    async def call(self, operation: str, **params: tp.Any) -> tp.Any:
+        """
+        :return: result of the operation, binary results stay base64 encoded
+        :raises RuntimeError: if the server reports an error
+        """
+        request_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(encode_frame({'id': request_id, 'op': operation, **params}))
+        await self._writer.drain()
+        response = await future
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    async def close(self) -> None:
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._reader_task.cancel()
+
+
+def main(argv: tp.Optional[tp.Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Encryption and signing service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8470)
+    parser.add_argument('--unix', default=None, help='path of the unix socket to listen on instead of TCP')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cipher-key', action='append', default=[], metavar='ALG=PATH',
+                        help='block cipher key file made by "mzi genkey", may be repeated')
+    parser.add_argument('--rsa-primes', default=None, metavar='P,Q', help='primes to generate RSA keys from')
+    parser.add_argument('--dsa-primes', default=None, metavar='P,Q', help='lab6 signature parameters')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-batch-delay', type=float, default=0.002)
+    args = parser.parse_args(argv)
+
+    key_material = KeyMaterial()
+    for value in args.cipher_key:
+        algorithm, _, path = value.partition('=')
+        with open(path, 'rb') as f:
+            key_material.cipher_keys[algorithm] = f.read()
+    if args.rsa_primes is not None:
+        key_material.rsa_keys = get_algorithm('rsa').generate_key_pair(*map(int, args.rsa_primes.split(',')))
+    if args.dsa_primes is not None:
+        key_material.dsa = get_algorithm('dsa')(*map(int, args.dsa_primes.split(',')))
+
+    server = Server(key_material, args.workers, args.max_batch_size, args.max_batch_delay)
+    asyncio.run(server.serve(args.host, args.port, args.unix))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import typing as tp
+import dataclasses
+import hmac
+
+from hashlib import sha256
+
+
+@dataclasses.dataclass(frozen=True)
+class Signature:
+    r: int
+    s: int
+
+
+def _bits_to_int(data: bytes, q: int) -> int:
+    result = int.from_bytes(data, byteorder='big', signed=False)
+    excess_bits = len(data) * 8 - q.bit_length()
+    return result >> excess_bits if excess_bits > 0 else result
+
+
+def _int_to_octets(num: int, q: int) -> bytes:
+    return num.to_bytes((q.bit_length() + 7) // 8, byteorder='big', signed=False)
+
+
+def generate_deterministic_nonces(private_key: int, message_hash: int, q: int) -> tp.Generator[int, None, None]:
+    """
+    Generates session keys as described in RFC 6979 (with HMAC-SHA256), so signing needs no random
+    number generator and no shared state. Next value should only be taken if the previous one produced
+    a degenerate signature (r = 0 or s = 0)
+    :param private_key: private key of the signer, 0 < private_key < q
+    :param message_hash: sha256 of the message as an integer
+    :param q: order of the group the signature is computed in
+    :return: yields session keys in range [1, q - 1]
+    """
+    hash_octets = _int_to_octets(_bits_to_int(message_hash.to_bytes(32, byteorder='big'), q) % q, q)
+    key_octets = _int_to_octets(private_key, q)
+    v = b'\x01' * 32
+    k = b'\x00' * 32
+    k = hmac.new(k, v + b'\x00' + key_octets + hash_octets, sha256).digest()
+    v = hmac.new(k, v, sha256).digest()
+    k = hmac.new(k, v + b'\x01' + key_octets + hash_octets, sha256).digest()
+    v = hmac.new(k, v, sha256).digest()
+    while True:
+        t = b''
+        while len(t) * 8 < q.bit_length():
+            v = hmac.new(k, v, sha256).digest()
+            t += v
+        nonce = _bits_to_int(t, q)
+        if 1 <= nonce < q:
+            yield nonce
+        k = hmac.new(k, v + b'\x00', sha256).digest()
+        v = hmac.new(k, v, sha256).digest()
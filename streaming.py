@@ -0,0 +1,173 @@
+import typing as tp
+import dataclasses
+import json
+import os
+import queue
+import threading
+
+from bitarray import bitarray
+
+from algorithms import get_algorithm, resolve
+from block_cipher import BlockCipher
+
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+# amount of chunks waiting in each of the read-ahead and write-behind queues
+QUEUE_DEPTH = 2
+CIPHER_ALGORITHMS = ('des', 'double_des', 'triple_des', 'gost', 'stb')
+DES_KEYS_AMOUNT = {'des': 1, 'double_des': 2, 'triple_des': 2}
+RAW_KEY_LENGTH = 32
+DES_KEY_LENGTH = 7
+
+
+def _to_bits(data: bytes) -> bitarray:
+    result = bitarray()
+    result.frombytes(data)
+    return result
+
+
+def generate_key(algorithm: str) -> bytes:
+    """
+    Gost and Stb keys are raw 32 bytes. Des based ciphers also need their random permutations and S-boxes,
+    so their keys are JSON documents with parameters and hex encoded 56-bit keys
+    :param algorithm: one of CIPHER_ALGORITHMS
+    :return: content of the key file
+    """
+    if algorithm in ('gost', 'stb'):
+        return os.urandom(RAW_KEY_LENGTH)
+    key = {
+        'algorithm': algorithm,
+        'parameters': dataclasses.asdict(get_algorithm('des').generate_parameters()),
+        'keys': [os.urandom(DES_KEY_LENGTH).hex() for _ in range(DES_KEYS_AMOUNT[algorithm])],
+    }
+    return json.dumps(key).encode('UTF-8')
+
+
+def load_cipher(algorithm: str, key_data: bytes) -> BlockCipher:
+    """
+    :param algorithm: one of CIPHER_ALGORITHMS
+    :param key_data: content of the key file written by generate_key
+    :return: cipher ready to use
+    """
+    if algorithm in ('gost', 'stb'):
+        if len(key_data) != RAW_KEY_LENGTH:
+            raise ValueError(f'{algorithm} key should be exactly {RAW_KEY_LENGTH} bytes long')
+        return get_algorithm(algorithm)(_to_bits(key_data))
+    if algorithm not in DES_KEYS_AMOUNT:
+        raise ValueError(f'Unknown algorithm {algorithm}')
+
+    key = json.loads(key_data)
+    if key.get('algorithm') != algorithm:
+        raise ValueError(f'Key file is made for {key.get("algorithm")}, not {algorithm}')
+    keys = [_to_bits(bytes.fromhex(value)) for value in key['keys']]
+    if len(keys) != DES_KEYS_AMOUNT[algorithm] or any(len(value) != DES_KEY_LENGTH * 8 for value in keys):
+        raise ValueError('Wrong keys in the key file')
+    parameters = resolve('lab1_des:DesCipherConstParameters')(**key['parameters'])
+    return get_algorithm(algorithm)(parameters, *keys)
+
+
+class ReadAhead:
+    """
+    Reads chunks in a background thread, so reading of the next chunks overlaps with processing of the current one
+    """
+    def __init__(self, input_file: tp.BinaryIO, chunk_size: int, depth: int = QUEUE_DEPTH) -> None:
+        self._input_file = input_file
+        self._chunk_size = chunk_size
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                chunk = self._input_file.read(self._chunk_size)
+                self._queue.put(chunk)
+                if not chunk:
+                    return
+        except BaseException as e:
+            self._queue.put(e)
+
+    def __iter__(self) -> tp.Iterator[tp.Tuple[bytes, bool]]:
+        """
+        :return: yields chunks together with flag whether the chunk is the last one
+        """
+        current = self._get()
+        while current:
+            following = self._get()
+            yield current, not following
+            current = following
+
+    def _get(self) -> bytes:
+        item = self._queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+
+class WriteBehind:
+    """
+    Writes chunks in a background thread, so writing overlaps with processing of the following chunks
+    """
+    def __init__(self, output_file: tp.BinaryIO, depth: int = QUEUE_DEPTH) -> None:
+        self._output_file = output_file
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._error: tp.Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if self._error is None:
+                try:
+                    self._output_file.write(chunk)
+                except BaseException as e:
+                    self._error = e
+
+    def write(self, chunk: bytes) -> None:
+        if self._error is not None:
+            raise self._error
+        if chunk:
+            self._queue.put(chunk)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        self._output_file.flush()
+
+
+def encrypt_bytes(cipher: BlockCipher, data: bytes) -> bytearray:
+    """
+    :return: data encrypted into a new buffer, the last incomplete block is padded with zeros
+    """
+    result = bytearray(cipher.get_encrypted_length(len(data)))
+    cipher.encrypt_into(data, result)
+    return result
+
+
+def get_chunk_size(cipher: BlockCipher, chunk_size: int) -> int:
+    """
+    :return: chunk size rounded down to whole blocks, at least one block
+    """
+    block_length = cipher.block_length
+    return max(block_length, chunk_size - chunk_size % block_length)
+
+
+def xor_with_keystream(cipher: BlockCipher, nonce: bytes, first_block_no: int, chunk: bytes) -> bytes:
+    """
+    CTR mode: xors the chunk with encrypted blocks nonce || counter, the same call encrypts and decrypts
+    :param nonce: beginning of every counter block, the rest of the block is the big endian block number
+    :param first_block_no: number of the first block of the chunk in the whole stream
+    :raises ValueError: if the counter would wrap around and repeat the keystream
+    """
+    block_length = cipher.block_length
+    counter_length = block_length - len(nonce)
+    blocks_amount = -(-len(chunk) // block_length)
+    if first_block_no + blocks_amount > 1 << (counter_length * 8):
+        raise ValueError(f'Stream is too long for CTR mode with {counter_length * 8}-bit counter')
+    counters = b''.join(nonce + (first_block_no + i).to_bytes(counter_length, 'big') for i in range(blocks_amount))
+    keystream = encrypt_bytes(cipher, counters)
+    return (int.from_bytes(chunk, 'big') ^ int.from_bytes(keystream[:len(chunk)], 'big')).to_bytes(len(chunk), 'big')